@@ -1,27 +1,57 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import BaseModel, EmailStr, Field, validator
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, field_validator
 from datetime import timedelta, datetime
-from jose import jwt
 from typing import Optional
 from app.core.security import (
-    SECRET_KEY, 
-    ALGORITHM, 
+    create_access_token,
     hash_password, 
-    verify_password,
-    verify_token
+    verify_and_update_password,
+    run_kdf,
 )
-from app.db.database import database
+from app.db.database import database, upsert
 from app.db.models import users
-import re
+from sqlalchemy import select
+from app.core.variables import ACCESS_TOKEN_EXPIRE_MINUTES
+from app.core.cache import (
+    CACHED_USER_COLUMNS, cache_user, get_cached_user_by_id, invalidate_user,
+)
+from app.core.deps import get_current_user
 
 router = APIRouter()
 
-# Password validation regex
-password_regex = re.compile(r"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&]).{8,}$")
+# Password policy: >= 8 characters with a lowercase, an uppercase, a digit
+# and one of these specials. Checked in one pass instead of a regex with
+# four lookaheads that each rescan the string.
+PASSWORD_SPECIALS = frozenset("@$!%*?&")
+PASSWORD_MIN_LENGTH = 8
+
+def password_is_complex(value: str) -> bool:
+    # Mirrors the previous `^...{8,}$` regex, whose `$` also matched
+    # before a single trailing newline and whose `.` never matched one.
+    if value.endswith("\n"):
+        value = value[:-1]
+    if len(value) < PASSWORD_MIN_LENGTH:
+        return False
+
+    has_lower = has_upper = has_digit = has_special = False
+    for ch in value:
+        if "a" <= ch <= "z":
+            has_lower = True
+        elif "A" <= ch <= "Z":
+            has_upper = True
+        elif ch.isdecimal():
+            has_digit = True
+        elif ch in PASSWORD_SPECIALS:
+            has_special = True
+        elif ch == "\n":
+            return False
+    return has_lower and has_upper and has_digit and has_special
 
 def validate_password(value: str) -> str:
     """Validates password complexity."""
-    if not password_regex.match(value):
+    if not password_is_complex(value):
         raise ValueError(
             "Password must have at least 8 characters, including 1 uppercase, "
             "1 lowercase, 1 number, and 1 special character."
@@ -39,7 +69,8 @@ class UserCreate(BaseModel):
     email: EmailStr
     password: str 
 
-    @validator("password")
+    @field_validator("password")
+    @classmethod
     def password_validator(cls, value):
         return validate_password(value)
 
@@ -48,7 +79,8 @@ class UserEdit(BaseModel):
     email: Optional[EmailStr] = None
     password: Optional[str] = None
 
-    @validator("password")
+    @field_validator("password")
+    @classmethod
     def password_validator(cls, value):
         if value:
             return validate_password(value)
@@ -69,21 +101,16 @@ class User(BaseModel):
     is_admin: Optional[bool]
     created_at: Optional[datetime] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
-# Dependency Functions
-async def get_current_user(token: dict = Depends(verify_token)):
-    query = users.select().where(users.c.username == token["sub"])
-    user = await database.fetch_one(query)
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    return user
+# Rows read through these columns already match `User`, so hot read
+# endpoints serialize them straight to JSON without a pydantic pass.
+USER_COLUMNS = [users.c[field] for field in User.model_fields]
+
+def user_payload(row) -> dict:
+    return {column.name: row[column.name] for column in USER_COLUMNS}
 
+# Dependency Functions
 async def get_admin_user(current_user: dict = Depends(get_current_user)):
     if not current_user["is_admin"]:
         raise HTTPException(
@@ -95,26 +122,48 @@ async def get_admin_user(current_user: dict = Depends(get_current_user)):
 # Authentication Endpoints
 @router.post("/signup", status_code=status.HTTP_201_CREATED)
 async def signup(user: UserCreate):
-    existing = await database.fetch_one(
-        users.select().where(
-            (users.c.username == user.username) | 
-            (users.c.email == user.email)
+    # Hash in the KDF pool while the database answers the uniqueness
+    # pre-check; latency is max(kdf, query) instead of their sum.
+    hash_task = asyncio.ensure_future(run_kdf(hash_password, user.password))
+    try:
+        existing = await database.fetch_one(
+            select(users.c.username).where(
+                (users.c.username == user.username) |
+                (users.c.email == user.email)
+            ).limit(1)
         )
-    )
+    except BaseException:
+        # Don't leave the hash running with nobody to collect its result
+        hash_task.cancel()
+        raise
     if existing:
+        hash_task.cancel()
+        taken = "Username" if existing["username"] == user.username else "Email"
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
-            detail="Username or email already exists"
+            detail=f"{taken} already exists"
         )
+    hashed_pwd = await hash_task
 
-    hashed_pwd = hash_password(user.password)
-    query = users.insert().values(
-        username=user.username,
-        email=user.email,
-        hashed_password=hashed_pwd,
-        is_admin=False
+    # The insert itself still enforces uniqueness, so a concurrent signup
+    # that slipped past the pre-check gets a 409 rather than a duplicate.
+    query = (
+        upsert(users)
+        .values(
+            username=user.username,
+            email=user.email,
+            hashed_password=hashed_pwd,
+            is_admin=False
+        )
+        .on_conflict_do_nothing()
+        .returning(users.c.id)
     )
-    await database.execute(query)
+    created = await database.fetch_one(query)
+    if not created:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Username or email already exists"
+        )
     return {"message": "User created successfully"}
 
 @router.post("/login", response_model=Token)
@@ -123,82 +172,115 @@ async def login(user: UserLogin):
         users.select().where(users.c.username == user.username)
     )
     
-    if not db_user or not verify_password(user.password, db_user["hashed_password"]):
+    valid, new_hash = (False, None)
+    if db_user:
+        valid, new_hash = await run_kdf(
+            verify_and_update_password, user.password, db_user["hashed_password"]
+        )
+
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    token_expires = timedelta(minutes=1440)  # 24 hours
-    access_token = jwt.encode(
-        {
-            "sub": db_user["username"],
-            "exp": datetime.utcnow() + token_expires,
-            "admin": db_user["is_admin"]
-        },
-        SECRET_KEY,
-        algorithm=ALGORITHM
-    )
+    # Upgrade legacy (bcrypt) or outdated argon2 hashes transparently
+    if new_hash:
+        await database.execute(
+            users.update()
+            .where(users.c.id == db_user["id"])
+            .values(hashed_password=new_hash)
+        )
+        invalidate_user(db_user["id"])
+
+    # Only the subject is signed; admin rights are read from the (cached)
+    # user row so they take effect without reissuing tokens.
+    token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token({"sub": db_user["username"]}, token_expires)
     return {"access_token": access_token, "token_type": "bearer"}
 
 # User Management Endpoints
 @router.get("/users/me", response_model=User)
 async def read_current_user(current_user: dict = Depends(get_current_user)):
-    return current_user
+    return ORJSONResponse(user_payload(current_user))
 
 @router.patch("/users/me", response_model=User)
 async def update_current_user(
     user_data: UserEdit,
     current_user: dict = Depends(get_current_user)
 ):
-    update_data = user_data.dict(exclude_unset=True)
+    update_data = user_data.model_dump(exclude_unset=True)
     
     if "password" in update_data:
-        update_data["hashed_password"] = hash_password(update_data.pop("password"))
-    
-    if update_data:
-        query = (
-            users.update()
-            .where(users.c.id == current_user["id"])
-            .values(**update_data)
-        )
-        await database.execute(query)
+        update_data["hashed_password"] = await run_kdf(hash_password, update_data.pop("password"))
     
-    return await database.fetch_one(
-        users.select().where(users.c.id == current_user["id"])
+    if not update_data:
+        return current_user
+
+    query = (
+        users.update()
+        .where(users.c.id == current_user["id"])
+        .values(**update_data)
+        .returning(*users.c)
     )
+    user = await database.fetch_one(query)
+    invalidate_user(current_user["id"])
+    return user
+
+async def stream_users(query):
+    """Yield users as newline-delimited JSON, one row at a time."""
+    async for row in database.iterate(query):
+        yield User.model_validate(row).model_dump_json() + "\n"
 
 @router.get("/users", response_model=list[User])
 async def search_users(
     search: Optional[str] = None,
     limit: int = 100,
     offset: int = 0,
+    after: Optional[int] = None,
+    stream: bool = False,
     admin: dict = Depends(get_admin_user)
 ):
-    query = users.select().limit(limit).offset(offset)
+    """
+    List users ordered by id. Pass the last id seen as `after` for keyset
+    paging; `offset` is still honoured when `after` is not given.
+    With `stream=true` rows are sent as NDJSON while they are read.
+    """
+    query = select(*USER_COLUMNS).order_by(users.c.id).limit(limit)
+    if after is not None:
+        query = query.where(users.c.id > after)
+    elif offset:
+        query = query.offset(offset)
     if search:
         search = f"%{search}%"
         query = query.where(
             users.c.username.ilike(search) |
             users.c.email.ilike(search)
         )
-    return await database.fetch_all(query)
+    if stream:
+        return StreamingResponse(stream_users(query), media_type="application/x-ndjson")
+    rows = await database.fetch_all(query)
+    return ORJSONResponse([user_payload(row) for row in rows])
 
 @router.get("/users/{user_id}", response_model=User)
 async def read_user(
     user_id: int,
     admin: dict = Depends(get_admin_user)
 ):
+    user = get_cached_user_by_id(user_id)
+    if user:
+        return user
+
     user = await database.fetch_one(
-        users.select().where(users.c.id == user_id)
+        select(*CACHED_USER_COLUMNS).where(users.c.id == user_id)
     )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
-    return user
+    return cache_user(user)
 
 @router.patch("/users/{user_id}", response_model=User)
 async def update_user(
@@ -206,36 +288,35 @@ async def update_user(
     user_data: AdminUserEdit,
     admin: dict = Depends(get_admin_user)
 ):
-    existing = await database.fetch_one(
-        users.select().where(users.c.id == user_id)
-    )
-    if not existing:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-
-    update_data = user_data.dict(exclude_unset=True)
+    update_data = user_data.model_dump(exclude_unset=True)
     
     if "password" in update_data:
-        update_data["hashed_password"] = hash_password(update_data.pop("password"))
+        update_data["hashed_password"] = await run_kdf(hash_password, update_data.pop("password"))
     
     if update_data:
         query = (
             users.update()
             .where(users.c.id == user_id)
             .values(**update_data)
+            .returning(*users.c)
         )
-        await database.execute(query)
-    
-    return await database.fetch_one(
-        users.select().where(users.c.id == user_id)
-    )
+    else:
+        query = users.select().where(users.c.id == user_id)
+
+    user = await database.fetch_one(query)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    invalidate_user(user_id)
+    return user
 
 @router.delete("/users/me", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_current_user(current_user: dict = Depends(get_current_user)):
     query = users.delete().where(users.c.id == current_user["id"])
     await database.execute(query)
+    invalidate_user(current_user["id"])
     return {"message": "Account deleted successfully"}
 
 @router.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -254,4 +335,5 @@ async def delete_user(
 
     query = users.delete().where(users.c.id == user_id)
     await database.execute(query)
+    invalidate_user(user_id)
     return {"message": "User deleted successfully"}
\ No newline at end of file
@@ -3,7 +3,8 @@ from mcp.server import Server, NotificationOptions
 from mcp.server.models import InitializationOptions
 import mcp.server.stdio
 import mcp.types as types
-from mcp_tools import list_vms, list_templates, get_vm_metrics, get_vm_costs, update_vm
+from operator import itemgetter
+from mcp_tools import list_vms, list_templates, get_vm_metrics, get_vm_costs, update_vm, get_overview, close_client
 import httpx  # Add this import
 
 server = Server("virtuoso-server")
@@ -31,6 +32,16 @@ async def handle_list_tools() -> list[types.Tool]:
                 "x-auth-context": True
             }
         ),
+        types.Tool(
+            name="get-overview",
+            description="Get VMs, templates and VM metrics in a single call",
+            inputSchema={
+                "type": "object",
+                "properties": {},
+                "required": [],
+                "x-auth-context": True
+            }
+        ),
         types.Tool(
             name="get-vm-metrics",
             description="Get metrics for a VM",
@@ -98,6 +109,13 @@ async def handle_call_tool(
                 text=format_vms(vms) if vms else "No VMs found"
             )]
             
+        elif name == "get-overview":
+            overview = await get_overview(token)
+            return [types.TextContent(
+                type="text",
+                text=format_overview(overview)
+            )]
+            
         elif name == "get-vm-metrics":
             vm_id = clean_args.get("vm_id")
             metrics = await get_vm_metrics(token, vm_id)
@@ -153,6 +171,11 @@ async def handle_call_tool(
             text=f"Unexpected Error: {str(e)}"
         )]
         
+# Field extractors for the formatters whose keys were always required;
+# the VM and cost formatters keep per-field defaults.
+_template_fields = itemgetter("name", "max_cpu", "max_ram")
+_metric_fields = itemgetter("cpu_usage", "memory_usage")
+
 def format_vms(vms):
     if not vms or not isinstance(vms, list):
         return "No virtual machines found"
@@ -160,24 +183,30 @@ def format_vms(vms):
     formatted = []
     for vm in vms:
         try:
-            entry = (
+            formatted.append(
                 f"{vm.get('name', 'Unknown')} "
                 f"(ID: {vm.get('id', 'N/A')}) | "
-                f"Status: {vm.get('kube_status', {}).get('status', 'unknown')}"
+                f"Status: {(vm.get('kube_status') or {}).get('status', 'unknown')}"
             )
-            formatted.append(entry)
         except Exception as e:
             continue
             
     return "\n".join(formatted) if formatted else "No virtual machines available"
 
 def format_templates(templates):
-    return "\n".join([f"{t['name']} | MAX. CPU: {t['max_cpu']} | MAX. RAM: {t['max_ram']}GB"
-                     for t in templates])
+    return "\n".join([f"{name} | MAX. CPU: {cpu} | MAX. RAM: {ram}GB"
+                     for name, cpu, ram in map(_template_fields, templates)])
 
 def format_metrics(metrics):
-    return "\n".join([f"{m.get('vm_name', '') } | CPU: {m['cpu_usage']} | RAM: {m['memory_usage']}"
-                     for m in metrics])
+    return "\n".join([f"{m.get('vm_name', '')} | CPU: {cpu} | RAM: {ram}"
+                     for m, (cpu, ram) in zip(metrics, map(_metric_fields, metrics))])
+
+def format_overview(overview):
+    return "\n\n".join([
+        "VMs:\n" + format_vms(overview["vms"]),
+        "Templates:\n" + (format_templates(overview["templates"]) or "No templates found"),
+        "Metrics:\n" + (format_metrics(overview["metrics"]) or "No metrics available"),
+    ])
 
 def format_costs(costs):
     """Completely null-safe formatting"""
@@ -193,7 +222,7 @@ def format_costs(costs):
             return "No cost records available"
             
         return "\n".join([
-            f"{c.get('recorded_at', 'Unknown date')} | "
+            f"{c.get('recorded_at') or 'Unknown date'} | "
             f"CPU: {c.get('cpu_cores', 0)} | "
             f"RAM: {c.get('ram_gb', 0)}GB | "
             f"Cost: ${float(c.get('cost_per_hour', 0))/100:.2f}/hr"
@@ -216,19 +245,22 @@ def format_update_result(result):
     )
 
 async def main():
-    async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            InitializationOptions(
-                server_name="virtuoso-server",
-                server_version="0.1.0",
-                capabilities=server.get_capabilities(
-                    notification_options=NotificationOptions(),
-                    experimental_capabilities={},
+    try:
+        async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
+            await server.run(
+                read_stream,
+                write_stream,
+                InitializationOptions(
+                    server_name="virtuoso-server",
+                    server_version="0.1.0",
+                    capabilities=server.get_capabilities(
+                        notification_options=NotificationOptions(),
+                        experimental_capabilities={},
+                    )
                 )
             )
-        )
+    finally:
+        await close_client()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
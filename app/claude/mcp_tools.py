@@ -1,27 +1,38 @@
+import asyncio
 import httpx
 import logging
+import orjson
 from typing import Optional, List, Dict, Any
 
 logger = logging.getLogger(__name__)
 FASTAPI_URL = "http://localhost:8000"
 
+# One keep-alive pool for every tool call instead of a client per request
+CLIENT = httpx.AsyncClient(
+    base_url=FASTAPI_URL,
+    timeout=10,
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    follow_redirects=True,
+)
+
+async def close_client():
+    await CLIENT.aclose()
+
 # Modify api_request in mcp_tools.py
 async def api_request(method: str, endpoint: str, token: str, payload: Optional[dict] = None) -> List[Dict[str, Any]]:
     try:
-        async with httpx.AsyncClient(follow_redirects=True) as client:
-            response = await client.request(
-                method,
-                f"{FASTAPI_URL}{endpoint}",
-                headers={"Authorization": f"Bearer {token}"},
-                json=payload,
-                timeout=10
-            )
-            response.raise_for_status()
-            data = response.json()
-            if isinstance(data, list):
-                return data
-            else:
-                return [data] if data else []
+        response = await CLIENT.request(
+            method,
+            endpoint,
+            headers={"Authorization": f"Bearer {token}"},
+            json=payload,
+        )
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+        if isinstance(data, list):
+            return data
+        else:
+            return [data] if data else []
             
     except httpx.HTTPStatusError as e:
         logger.error(f"API Error {e.response.status_code}: {e.response.text}")
@@ -49,19 +60,26 @@ async def list_templates(token: str) -> List[Dict[str, Any]]:
 async def get_vm_costs(token: str, vm_id: int) -> List[Dict[str, Any]]:
     return await api_request("GET", f"/vms/{vm_id}/costs/", token)
 
+async def get_overview(token: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Fetch VMs, templates and metrics concurrently over the shared client."""
+    vms, templates, metrics = await asyncio.gather(
+        list_vms(token),
+        list_templates(token),
+        get_vm_metrics(token),
+    )
+    return {"vms": vms, "templates": templates, "metrics": metrics}
+
 # Add to mcp_tools.py
 async def update_vm(token: str, vm_id: int, cpu: int, ram: int) -> Dict[str, Any]:
     endpoint = f"/vms/{vm_id}"
     try:
-        async with httpx.AsyncClient(follow_redirects=True) as client:
-            response = await client.patch(
-                f"{FASTAPI_URL}{endpoint}",
-                headers={"Authorization": f"Bearer {token}"},
-                json={"cpu": cpu, "ram": ram},
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await CLIENT.patch(
+            endpoint,
+            headers={"Authorization": f"Bearer {token}"},
+            json={"cpu": cpu, "ram": ram},
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
     except httpx.HTTPStatusError as e:
         logger.error(f"Update Error {e.response.status_code}: {e.response.text}")
         raise RuntimeError(f"Update failed: {e.response.text}")
@@ -1,17 +1,37 @@
+import asyncio
+import math
+import os
+import re
 from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from app.core.security import verify_token
 from app.db.database import database
 from app.db.models import users
-from anthropic import Anthropic
+from anthropic import AsyncAnthropic
 from typing import Optional
 from contextlib import AsyncExitStack
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
-from app.core.variables import *
+from app.core.variables import CLAUDE_KEY, MCP_TOOLS_TOP_K, MCP_SERVER_SCRIPT
 
 router = APIRouter()
 
+_WORD = re.compile(r"[a-z0-9]+")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do for from how i in is it me my of on or "
+    "please show the this to what which with you your".split()
+)
+
+def _terms(text: str) -> set:
+    # Lowercase words with a naive plural strip, so "costs" matches "cost"
+    return {
+        w[:-1] if len(w) > 2 and w.endswith("s") else w
+        for w in _WORD.findall(text.lower())
+        if w not in _STOPWORDS
+    }
+
 class Message(BaseModel):
     text: str
 
@@ -19,10 +39,22 @@ class MCPClient:
     def __init__(self):
         self.session: Optional[ClientSession] = None
         self.exit_stack = AsyncExitStack()
-        self.anthropic = Anthropic(api_key=CLAUDE_KEY)
-        self.current_token: Optional[str] = None
+        # One client for the process so its HTTP connection pool is reused
+        self.anthropic = AsyncAnthropic(api_key=CLAUDE_KEY, max_retries=2, timeout=60.0)
+        # Serializes the lazy subprocess spawn across concurrent /chat
+        # requests; ClientSession itself multiplexes calls by request id.
+        self._connect_lock = asyncio.Lock()
+        # Tool schemas only change when the server restarts; filled on connect
+        self._tools_cache: list = []
+        self._tool_terms: list = []
+        self._term_idf: dict = {}
 
     async def connect_to_server(self, server_script_path: str):
+        # Idempotent: a caller that lost the race on _connect_lock must not
+        # spawn a second server and clobber the live session.
+        if self.session:
+            return
+
         is_python = server_script_path.endswith('.py')
         command = "python3" if is_python else "node"
         server_params = StdioServerParameters(
@@ -36,53 +68,125 @@ class MCPClient:
         self.session = await self.exit_stack.enter_async_context(ClientSession(self.stdio, self.write))
         await self.session.initialize()
 
-    async def process_query(self, query: str, token: str) -> str:
-        self.current_token = token
-        messages = [{"role": "user", "content": query}]
-        
         response = await self.session.list_tools()
-        available_tools = [{
+        self._tools_cache = [{
             "name": tool.name,
             "description": tool.description,
-            "input_schema": tool.inputSchema
+            "input_schema": {
+                **tool.inputSchema,
+                # Add authentication context to tool definitions
+                "properties": {
+                    **tool.inputSchema.get("properties", {}),
+                    "_auth_token": {"type": "string", "x-internal": True},
+                },
+            },
         } for tool in response.tools]
 
-        # Add authentication context to tool definitions
-        for tool in available_tools:
-            tool["input_schema"]["properties"]["_auth_token"] = {
-                "type": "string",
-                "x-internal": True
-            }
+        self._tool_terms = [
+            _terms(f"{tool['name']} {tool['description'] or ''}")
+            for tool in self._tools_cache
+        ]
+        doc_freq = {}
+        for terms in self._tool_terms:
+            for term in terms:
+                doc_freq[term] = doc_freq.get(term, 0) + 1
+        total = len(self._tool_terms)
+        # A term every tool shares (e.g. "vm") tells them apart no better
+        # than no term at all, so it gets no weight
+        self._term_idf = {
+            term: math.log(total / df) for term, df in doc_freq.items() if df < total
+        }
+
+    def select_tools(self, query: str) -> list:
+        """Top-K tool definitions by IDF-weighted term overlap with the query.
+
+        Only narrows the list when K tools match and the K-th clearly
+        outscores the first one left out; otherwise every tool is sent, since
+        a query worded unlike the descriptions ("memory" for RAM) would
+        drop the tool it needs.
+        """
+        if len(self._tools_cache) <= MCP_TOOLS_TOP_K:
+            return self._tools_cache
 
-        response = self.anthropic.messages.create(
+        query_terms = _terms(query)
+        scores = [
+            sum(self._term_idf.get(term, 0.0) for term in query_terms & terms)
+            for terms in self._tool_terms
+        ]
+        ranked = sorted(range(len(scores)), key=lambda i: -scores[i])
+        cutoff, first_dropped = scores[ranked[MCP_TOOLS_TOP_K - 1]], scores[ranked[MCP_TOOLS_TOP_K]]
+        if cutoff <= 0 or cutoff <= first_dropped:
+            return self._tools_cache
+        # Keep the server's declaration order for the selected tools
+        return [self._tools_cache[i] for i in sorted(ranked[:MCP_TOOLS_TOP_K])]
+
+    async def call_tools(self, tool_uses: list, token: str) -> list:
+        # Independent tool calls share the session concurrently instead of
+        # paying one stdio round-trip each.
+        results = await asyncio.gather(*[
+            # Inject auth token into tool arguments
+            self.session.call_tool(tool_use.name, {**(tool_use.input or {}), "_auth_token": token})
+            for tool_use in tool_uses
+        ])
+        return [
+            f"[Tool {tool_use.name} result: {result.content}]"
+            for tool_use, result in zip(tool_uses, results)
+        ]
+
+    async def process_query(self, query: str, token: str) -> str:
+        messages = [{"role": "user", "content": query}]
+        
+        available_tools = self.select_tools(query)
+
+        response = await self.anthropic.messages.create(
             model="claude-3-5-sonnet-20241022",
             max_tokens=1000,
             messages=messages,
             tools=available_tools
         )
 
-        final_text = []
-        for content in response.content:
-            if content.type == 'text':
-                final_text.append(content.text)
-            elif content.type == 'tool_use':
-                # Inject auth token into tool arguments
-                tool_args = content.input or {}
-                tool_args["_auth_token"] = self.current_token
-                
-                result = await self.session.call_tool(
-                    content.name,
-                    tool_args  # Now passes token within arguments
-                )
-                final_text.append(f"[Tool {content.name} result: {result.content}]")
+        tool_uses = [c for c in response.content if c.type == "tool_use"]
+        tool_results = iter(await self.call_tools(tool_uses, token))
 
+        # Keep Claude's block order: each tool_use is replaced by its result
+        final_text = [
+            content.text if content.type == "text" else next(tool_results)
+            for content in response.content
+            if content.type in ("text", "tool_use")
+        ]
         return "\n".join(final_text)
 
+    async def stream_query(self, query: str, token: str):
+        """Yield Claude's text as it arrives, then the tool results."""
+        messages = [{"role": "user", "content": query}]
+
+        async with self.anthropic.messages.stream(
+            model="claude-3-5-sonnet-20241022",
+            max_tokens=1000,
+            messages=messages,
+            tools=self.select_tools(query)
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+            response = await stream.get_final_message()
+
+        tool_uses = [c for c in response.content if c.type == "tool_use"]
+        for tool_result in await self.call_tools(tool_uses, token):
+            yield "\n" + tool_result
+
     async def cleanup(self):
         await self.exit_stack.aclose()
+        self.session = None
+        self.exit_stack = AsyncExitStack()
 
 mcp_client = MCPClient()
-SERVER_SCRIPT_PATH = "/home/sushi/Desktop/virtuoso/app/claude/mcp_server.py"
+SERVER_SCRIPT_PATH = MCP_SERVER_SCRIPT or os.path.join(os.path.dirname(os.path.abspath(__file__)), "mcp_server.py")
+
+async def ensure_connected():
+    if not mcp_client.session:
+        async with mcp_client._connect_lock:
+            if not mcp_client.session:
+                await mcp_client.connect_to_server(SERVER_SCRIPT_PATH)
 
 @router.post("/chat", response_model=Message)
 async def chat(message: Message, request: Request, user=Depends(verify_token)):
@@ -92,9 +196,27 @@ async def chat(message: Message, request: Request, user=Depends(verify_token)):
     raw_token = auth_header.split(" ")[1]
 
     try:
-        if not mcp_client.session:
-            await mcp_client.connect_to_server(SERVER_SCRIPT_PATH)
+        await ensure_connected()
         response_text = await mcp_client.process_query(message.text, raw_token)
         return {"text": response_text}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing query: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error processing query: {e}")
+
+@router.post("/chat/stream")
+async def chat_stream(message: Message, request: Request, user=Depends(verify_token)):
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Invalid auth header")
+    raw_token = auth_header.split(" ")[1]
+
+    # Connect before the response starts; past that point errors can no
+    # longer turn into a status code.
+    try:
+        await ensure_connected()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing query: {e}")
+
+    return StreamingResponse(
+        mcp_client.stream_query(message.text, raw_token),
+        media_type="text/plain; charset=utf-8",
+    )
\ No newline at end of file
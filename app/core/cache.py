@@ -0,0 +1,66 @@
+from cachetools import TTLCache
+from app.db.models import users
+
+# ------------------ User Row Cache ------------------
+# Users are looked up on every authenticated request but change rarely.
+# Rows are kept for a short TTL (bounded LRU) and dropped on every write
+# in this process; other workers converge within USER_CACHE_TTL.
+USER_CACHE_SIZE = 4096
+USER_CACHE_TTL = 30  # seconds
+
+# Every lookup that fills the cache selects exactly these columns, so a
+# hit has the same keys whichever router stored it; the password hash
+# is never cached.
+CACHED_USER_COLUMNS = (
+    users.c.id, users.c.username, users.c.email, users.c.is_admin, users.c.created_at,
+)
+
+_users_by_name = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+_users_by_id = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def get_cached_user(username: str):
+    return _users_by_name.get(username)
+
+
+def get_cached_user_by_id(user_id: int):
+    return _users_by_id.get(user_id)
+
+
+def cache_user(user) -> dict:
+    """Store a user row under both its username and id; returns it as a dict."""
+    user = dict(user)
+    _users_by_name[user["username"]] = user
+    _users_by_id[user["id"]] = user
+    return user
+
+
+def invalidate_user(user_id: int) -> None:
+    """Forget a user, including entries under a username it no longer has."""
+    _users_by_id.pop(user_id, None)
+    for username, cached in list(_users_by_name.items()):
+        if cached["id"] == user_id:
+            _users_by_name.pop(username, None)
+
+
+# ------------------ Template Caps Cache ------------------
+# VM resizes clamp to their template's max_cpu/max_ram; templates are
+# admin-edited and rare, and the template routes drop entries on write.
+TEMPLATE_CACHE_SIZE = 256
+TEMPLATE_CACHE_TTL = 300  # seconds
+
+_template_caps = TTLCache(maxsize=TEMPLATE_CACHE_SIZE, ttl=TEMPLATE_CACHE_TTL)
+
+
+def get_cached_template_caps(template_id: int):
+    return _template_caps.get(template_id)
+
+
+def cache_template_caps(template_id: int, caps) -> dict:
+    caps = dict(caps)
+    _template_caps[template_id] = caps
+    return caps
+
+
+def invalidate_template(template_id: int) -> None:
+    _template_caps.pop(template_id, None)
@@ -0,0 +1,39 @@
+from typing import Annotated
+
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import bindparam, select
+
+from app.core.cache import get_cached_user, cache_user, CACHED_USER_COLUMNS
+from app.core.security import verify_token
+from app.db.database import database
+from app.db.models import users
+
+# ------------------ Current User Dependency ------------------
+# Shared by every router, so all of them resolve the caller through the
+# same statement and the same user cache.
+_USER_BY_NAME = select(*CACHED_USER_COLUMNS).where(users.c.username == bindparam("username"))
+
+
+async def get_user_from_token(decoded_token: dict) -> dict:
+    """Fetch user details based on JWT token (sub=username), through the shared user cache."""
+    user = get_cached_user(decoded_token["sub"])
+    if user:
+        return user
+
+    user = await database.fetch_one(_USER_BY_NAME.params(username=decoded_token["sub"]))
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    return cache_user(user)
+
+
+async def get_current_user(token: dict = Depends(verify_token)) -> dict:
+    """Resolve the caller once per request; endpoints take it as `user: CurrentUser`."""
+    return await get_user_from_token(token)
+
+
+CurrentUser = Annotated[dict, Depends(get_current_user)]
@@ -0,0 +1,77 @@
+import asyncio
+import ssl
+from types import MappingProxyType
+from typing import Optional
+
+import aiohttp
+import httpx
+
+from app.core.variables import HEADERS_BYTES, KUBERNETES_CA_BUNDLE
+
+# ------------------ Shared Kubernetes Clients ------------------
+# Built once and shared by both clients, so the CA bundle is loaded a
+# single time and TLS sessions can be resumed across connections
+KUBE_SSL_CONTEXT = ssl.create_default_context(cafile=KUBERNETES_CA_BUNDLE) if KUBERNETES_CA_BUNDLE else None
+
+# One pooled client per process keeps TCP/TLS connections to the API
+# server alive across requests instead of handshaking on every call.
+# The service-account header is attached here, so call sites pass none.
+# Over TLS the API server negotiates HTTP/2, so concurrent fan-outs and the
+# informer watches share one connection as multiplexed streams.
+kube_client = httpx.AsyncClient(
+    http2=True,
+    verify=KUBE_SSL_CONTEXT or False,
+    headers=HEADERS_BYTES,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60),
+    timeout=httpx.Timeout(10.0),
+)
+# Request bodies are serialized with orjson and sent as `content=`; this
+# supplies the Content-Type that httpx's `json=` would have set
+JSON_HEADERS = MappingProxyType({b"Content-Type": b"application/json"})
+# Watch streams stay open until the server ends them; only the connect
+# and writes are bounded
+WATCH_TIMEOUT = httpx.Timeout(10.0, read=None)
+
+# In-flight GETs by (url, params): concurrent callers asking for the same
+# object share one API server round trip and the same (fully read) response
+_inflight_gets: dict = {}
+
+
+async def kube_get(url: str, params: Optional[dict] = None) -> httpx.Response:
+    key = (url, tuple(sorted(params.items())) if params else ())
+    request = _inflight_gets.get(key)
+    if request is None:
+        request = asyncio.ensure_future(kube_client.get(url, params=params))
+        _inflight_gets[key] = request
+        request.add_done_callback(lambda _: _inflight_gets.pop(key, None))
+    # A cancelled caller must not cancel the request the others wait on
+    return await asyncio.shield(request)
+
+
+_ws_session: Optional[aiohttp.ClientSession] = None
+
+
+# VNC sessions are long-lived bulk binary streams: no cap on concurrent
+# sockets, same TLS settings as kube_client
+WS_CONNECT_OPTIONS = {
+    "compress": 0,       # no permessage-deflate; framebuffer updates are mostly incompressible
+    "max_msg_size": 0,   # no 4 MiB cap on large framebuffer updates
+    "heartbeat": 30,
+    "autoping": True,
+}
+
+
+def get_ws_session() -> aiohttp.ClientSession:
+    """Shared aiohttp session for the VNC websocket proxy, created lazily inside the running loop."""
+    global _ws_session
+    if _ws_session is None or _ws_session.closed:
+        _ws_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(ssl=KUBE_SSL_CONTEXT or False, limit=0, keepalive_timeout=30),
+        )
+    return _ws_session
+
+
+async def close_kube_clients():
+    await kube_client.aclose()
+    if _ws_session is not None:
+        await _ws_session.close()
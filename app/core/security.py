@@ -1,27 +1,132 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import jwt
+from cachetools import TLRUCache
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
 from passlib.context import CryptContext
 from fastapi import HTTPException, Security, Depends
 from fastapi.security import HTTPBearer
-from jose import jwt, JWTError
 from fastapi import WebSocket
-from app.core.variables import *
+from app.core.variables import SECRET_KEY, ALGORITHM, JWT_PRIVATE_KEY, KDF_WORKERS, WEB_CONCURRENCY
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
+
+# Argon2id, OWASP minimum profile: m=46 MiB, t=3, p=1 (~50ms per hash).
+# bcrypt stays verifiable so existing hashes keep working and get
+# rehashed to argon2 on the next successful login.
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__memory_cost=46 * 1024,
+    argon2__time_cost=3,
+    argon2__parallelism=1,
+)
 auth_scheme = HTTPBearer()
 
+# ------------------ JWT Keys ------------------
+# Key objects are built once at import: handing PEM bytes to jwt.encode
+# would re-parse (and for RSA, re-validate) the key on every login.
+# EdDSA (Ed25519) signs in a few microseconds and keeps the verification
+# key public; HS* algorithms use the shared SECRET_KEY.
+ASYMMETRIC_ALGORITHMS = ("RS", "PS", "ES", "EdDSA")
+
+if ALGORITHM.startswith(ASYMMETRIC_ALGORITHMS):
+    if JWT_PRIVATE_KEY:
+        SIGNING_KEY = serialization.load_pem_private_key(JWT_PRIVATE_KEY.encode(), password=None)
+    elif ALGORITHM == "EdDSA":
+        # Every worker would generate a different key and reject the
+        # tokens the others sign
+        if WEB_CONCURRENCY > 1:
+            raise RuntimeError("JWT_PRIVATE_KEY is required with more than one worker (WEB_CONCURRENCY)")
+        logger.warning("JWT_PRIVATE_KEY not set, generating an ephemeral Ed25519 key")
+        SIGNING_KEY = Ed25519PrivateKey.generate()
+    else:
+        raise RuntimeError(f"JWT_PRIVATE_KEY is required for {ALGORITHM}")
+    VERIFY_KEY = SIGNING_KEY.public_key()
+else:
+    SIGNING_KEY = VERIFY_KEY = SECRET_KEY
+
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str):
+    """Returns (valid, new_hash); new_hash is set when the stored hash needs an upgrade."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+# ------------------ KDF Worker Pool ------------------
+# Argon2 is CPU-bound (~50ms per call); a process pool keeps it off the
+# event loop and lets concurrent logins/signups hash on separate cores.
+_kdf_pool = None
+
+def start_kdf_pool():
+    global _kdf_pool
+    _kdf_pool = ProcessPoolExecutor(max_workers=KDF_WORKERS or os.cpu_count())
+
+def shutdown_kdf_pool():
+    global _kdf_pool
+    if _kdf_pool:
+        _kdf_pool.shutdown(wait=False, cancel_futures=True)
+        _kdf_pool = None
+
+async def run_kdf(func, *args):
+    """Run a password hashing function in the KDF pool (default executor if not started)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_kdf_pool, func, *args)
+
+def create_access_token(data: dict, expires_delta: timedelta) -> str:
+    payload = {**data, "exp": datetime.now(timezone.utc) + expires_delta}
+    return jwt.encode(payload, SIGNING_KEY, algorithm=ALGORITHM)
+
+# ------------------ Verified Token Cache ------------------
+# Clients reuse one bearer token for its whole lifetime, so verified
+# payloads are kept until the token's own `exp`, at most
+# TOKEN_CACHE_TTL; failures are never cached. Entries are keyed by the
+# token's SHA-256 so raw tokens are not held in memory. verify_token
+# runs in the threadpool, hence the lock.
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 60  # seconds
+
+def _token_expiry(_key, payload, now):
+    return min(payload["exp"], now + TOKEN_CACHE_TTL)
+
+_token_cache = TLRUCache(maxsize=TOKEN_CACHE_SIZE, ttu=_token_expiry, timer=time.time)
+_token_cache_lock = threading.Lock()
+
+def decode_token(token: str) -> dict:
+    key = hashlib.sha256(token.encode()).digest()
+    with _token_cache_lock:
+        payload = _token_cache.get(key)
+    if payload is not None:
+        return payload
+
+    payload = jwt.decode(token, VERIFY_KEY, algorithms=[ALGORITHM])
+    if "exp" in payload:
+        with _token_cache_lock:
+            _token_cache[key] = payload
+    return payload
+
 def verify_token(http_auth: str = Security(auth_scheme)):
     try:
         token = http_auth.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         return payload  # Returns the token payload
-    except JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 def ws_token_to_jwt(token: str):
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    return payload  # Returns the token payload
\ No newline at end of file
+    try:
+        payload = decode_token(token)
+        return payload  # Returns the token payload
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
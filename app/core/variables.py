@@ -1,14 +1,23 @@
 import os
+from types import MappingProxyType
 
 FRONTEND_URL = os.environ['FRONTEND_URL']
 BACKEND_URL = os.environ['BACKEND_URL']
 DATABASE_URL = os.environ['DATABASE_URL']
+DATABASE_POOL_MIN_SIZE = int(os.environ.get('DATABASE_POOL_MIN_SIZE') or 5)
+DATABASE_POOL_MAX_SIZE = int(os.environ.get('DATABASE_POOL_MAX_SIZE') or 15)
 
 KUBERNETES_API_URL = os.environ['KUBERNETES_API_URL']
 KUBERNATES_WS_URL = os.environ['KUBERNATES_WS_URL']
+# CA bundle for the API server certificate; without it TLS is not verified
+KUBERNETES_CA_BUNDLE = os.environ.get('KUBERNETES_CA_BUNDLE')
 HEADERS = {
     "Authorization": f"Bearer {os.environ['KUBERNETES_TOKEN']}"
 }
+# Pre-encoded once so httpx doesn't re-encode the token on every request
+HEADERS_BYTES = MappingProxyType({
+    key.encode(): value.encode() for key, value in HEADERS.items()
+})
 
 DEFAULT_NODE = os.environ['DEFAULT_NODE']
 
@@ -20,7 +29,17 @@ DEFAULT_ADMIN = os.environ['DEFAULT_ADMIN']
 DEFAULT_ADMIN_PWD = os.environ['DEFAULT_ADMIN_PWD']
 
 CLAUDE_KEY = os.environ['CLAUDE_KEY']
+# Tool definitions sent to Claude per query, ranked by relevance
+MCP_TOOLS_TOP_K = int(os.environ.get('MCP_TOOLS_TOP_K') or 4)
+# Defaults to the mcp_server.py shipped next to app/claude/routes.py
+MCP_SERVER_SCRIPT = os.environ.get('MCP_SERVER_SCRIPT')
 
 SECRET_KEY = os.environ['SECRET_KEY']
 ALGORITHM = os.environ['ALGORITHM']
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ['ACCESS_TOKEN_EXPIRE_MINUTES'])
\ No newline at end of file
+# PEM encoded private key, used for asymmetric algorithms (EdDSA, RS*, ES*, PS*)
+JWT_PRIVATE_KEY = os.environ.get('JWT_PRIVATE_KEY')
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ['ACCESS_TOKEN_EXPIRE_MINUTES'])
+# Password hashing processes; defaults to one per CPU
+KDF_WORKERS = int(os.environ.get('KDF_WORKERS') or 0)
+# uvicorn worker processes; each one builds its own JWT keys at import
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY') or 1)
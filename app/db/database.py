@@ -1,5 +1,23 @@
 from databases import Database
-from app.core.variables import *
+from app.core.variables import DATABASE_URL, DATABASE_POOL_MIN_SIZE, DATABASE_POOL_MAX_SIZE
 
 
-database = Database(DATABASE_URL)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# Dialect-aware insert() exposing on_conflict_do_nothing()/do_update()
+if IS_SQLITE:
+    from sqlalchemy.dialects.sqlite import insert as upsert
+else:
+    from sqlalchemy.dialects.postgresql import insert as upsert
+
+# SQLite opens a connection per task and takes no pool options; server
+# databases (asyncpg, aiomysql) get an explicitly bounded pool so bursts
+# queue on the pool instead of opening unbounded connections.
+if IS_SQLITE:
+    database = Database(DATABASE_URL)
+else:
+    database = Database(
+        DATABASE_URL,
+        min_size=DATABASE_POOL_MIN_SIZE,
+        max_size=DATABASE_POOL_MAX_SIZE,
+    )
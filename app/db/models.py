@@ -1,16 +1,29 @@
 from sqlalchemy import (
     create_engine, MetaData, Table, Column, Integer, String,
-    Boolean, DateTime, Text, ForeignKey
+    Boolean, DateTime, Text, ForeignKey, Index, DDL, event, func, inspect, select
 )
-from datetime import datetime
-from app.core.security import hash_password
-from app.db.database import database
-from app.core.variables import *
+from app.core.security import hash_password, run_kdf
+from app.db.database import database, IS_SQLITE
+from app.core.variables import DATABASE_URL, DEFAULT_ADMIN, DEFAULT_ADMIN_PWD
 
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False} if IS_SQLITE else {},
+)
 metadata = MetaData()
 
+# journal_mode=WAL is persisted in the database file, so the async
+# connections opened by `databases` run in WAL too (readers no longer
+# block the writer). Per-connection pragmas would only reach this
+# DDL-only engine, so none are set here.
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_wal(dbapi_conn, _):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
 users = Table(
     "users",
     metadata,
@@ -20,9 +33,26 @@ users = Table(
     Column("hashed_password", String),
     Column("is_active", Boolean, default=True),
     Column("is_admin", Boolean, default=False),
-    Column("created_at", DateTime, default=datetime.utcnow),
-    Column("updated_at", DateTime, default=datetime.utcnow, onupdate=datetime.utcnow),
+    Column("created_at", DateTime, default=func.current_timestamp()),
+    Column("updated_at", DateTime, default=func.current_timestamp(), onupdate=func.current_timestamp()),
+)
+
+# username/email already carry unique btree indexes (equality lookups).
+# The admin search does ILIKE '%term%', which only an index on trigrams
+# can serve; PostgreSQL only, SQLite keeps scanning.
+event.listen(
+    metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
 )
+Index(
+    "ix_users_username_trgm", users.c.username,
+    postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"},
+).ddl_if(dialect="postgresql")
+Index(
+    "ix_users_email_trgm", users.c.email,
+    postgresql_using="gin", postgresql_ops={"email": "gin_trgm_ops"},
+).ddl_if(dialect="postgresql")
 
 templates = Table(
     "templates",
@@ -36,8 +66,9 @@ templates = Table(
     Column("qemu_image", String, nullable=False),
     Column("description", String, nullable=True),
     Column("created_by", Integer, ForeignKey("users.id")),
-    Column("created_at", DateTime, default=datetime.utcnow),
+    Column("created_at", DateTime, default=func.current_timestamp()),
 )
+Index("ix_templates_created_by", templates.c.created_by)
 
 vm_instances = Table(
     "vm_instances",
@@ -47,8 +78,9 @@ vm_instances = Table(
     Column("namespace", String, nullable=False),
     Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
     Column("template_id", Integer, ForeignKey("templates.id"), nullable=True),
-    Column("created_at", DateTime, default=datetime.utcnow),
+    Column("created_at", DateTime, default=func.current_timestamp()),
 )
+Index("ix_vm_instances_user_id", vm_instances.c.user_id)
 
 vm_costs = Table(
     "vm_cost",
@@ -58,8 +90,10 @@ vm_costs = Table(
     Column("cpu_cores", Integer, nullable=False),
     Column("ram_gb", Integer, nullable=False),
     Column("cost_per_hour", Integer, nullable=False),  # Store in cents/millicents
-    Column("recorded_at", DateTime, default=datetime.utcnow),
+    Column("recorded_at", DateTime, default=func.current_timestamp()),
 )
+# Serves both "all costs of a VM" and "latest cost of a VM" (ORDER BY recorded_at DESC LIMIT 1)
+Index("ix_vm_costs_vm_instance_id_recorded_at", vm_costs.c.vm_instance_id, vm_costs.c.recorded_at)
 
 vm_snapshots = Table(
     "vm_snapshots",
@@ -67,22 +101,35 @@ vm_snapshots = Table(
     Column("id", Integer, primary_key=True),
     Column("vm_instance_id", Integer, ForeignKey("vm_instances.id"), nullable=False),
     Column("snapshot_name", String, unique=True, nullable=False),
-    Column("created_at", DateTime, default=datetime.utcnow),
+    Column("created_at", DateTime, default=func.current_timestamp()),
 )
+Index("ix_vm_snapshots_vm_instance_id", vm_snapshots.c.vm_instance_id)
 
 
 def create_tables():
-    """Create all tables in the database."""
-    print(datetime.utcnow())
-    metadata.create_all(engine)
+    """Create missing tables and indexes; only reads the schema once it is up to date."""
+    inspector = inspect(engine)
+    if not set(metadata.tables).issubset(inspector.get_table_names()):
+        metadata.create_all(engine)
+        inspector = inspect(engine)
+
+    # create_all skips tables that already exist, indexes included, so
+    # indexes added after a table was first created are ensured here.
+    for table in metadata.sorted_tables:
+        present = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in present:
+                index.create(engine, checkfirst=True)
 
 
 async def init_admin():
-    query = users.select().where(users.c.username == DEFAULT_ADMIN)
+    query = select(users.c.id).where(users.c.username == DEFAULT_ADMIN)
     admin_user = await database.fetch_one(query)
     
+    # Only hash on the first boot; an existing admin costs a single lookup
     if not admin_user:
+        hashed_password = await run_kdf(hash_password, DEFAULT_ADMIN_PWD)
         query = users.insert().values(
-            username=DEFAULT_ADMIN, email="", hashed_password=hash_password(DEFAULT_ADMIN_PWD), is_admin=True
+            username=DEFAULT_ADMIN, email="", hashed_password=hashed_password, is_admin=True
         )
         await database.execute(query)
@@ -1,17 +1,26 @@
+import logging
+
 from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 from app.db.database import database
 from app.db.models import create_tables, init_admin
+from app.core.security import start_kdf_pool, shutdown_kdf_pool
+from app.core.kube import close_kube_clients
+from app.vms.informer import start_informers, stop_informers
 from app.auth.routes import router as auth_router
 from app.vms.routes import router as vms_router
-from app.claude.routes import router as claude_router
+from app.claude.routes import router as claude_router, mcp_client, ensure_connected
 from fastapi.middleware.cors import CORSMiddleware
 from app.templates.routes import router as template_router
-from app.core.variables import *
+from app.core.variables import FRONTEND_URL
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="VM Manager",
     description="A web application to manage VMs on Kubernetes using KubeVirt",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 origins = [
@@ -37,13 +46,24 @@ app.include_router(template_router, prefix="/templates", tags=["Templates"])
 @app.on_event("startup")
 async def startup():
     create_tables()  # Create tables if they don't exist
+    start_kdf_pool()
     await database.connect()
     await init_admin()
+    start_informers()
+    # Spawn the MCP server now instead of on the first /claude/chat request
+    try:
+        await ensure_connected()
+    except Exception:
+        logger.warning("MCP server prewarm failed, retrying on first chat", exc_info=True)
 
 
 @app.on_event("shutdown")
 async def shutdown():
     await database.disconnect()
+    shutdown_kdf_pool()
+    await mcp_client.cleanup()
+    await stop_informers()
+    await close_kube_clients()
 
 # Root endpoint
 @app.get("/")
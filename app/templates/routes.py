@@ -1,32 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Response
 from pydantic import BaseModel
-from datetime import datetime
 import json
 from app.db.database import database
-from app.db.models import templates, users
-from app.core.security import verify_token
+from app.db.models import templates
+from app.core.cache import invalidate_template
+from app.core.deps import CurrentUser
 from typing import Optional, Dict, Any
 from app.templates.schemas import *
 from sqlalchemy import or_
 
 router = APIRouter()
 
-# ------------------ Helper: Fetch User from DB ------------------
-async def get_user_from_token(decoded_token: dict):
-    """Fetch user details from DB based on JWT token (sub=username)."""
-    query = users.select().where(users.c.username == decoded_token["sub"])
-    user = await database.fetch_one(query)
-
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-
-    return dict(user)  # Convert row to dictionary
+def template_json_response(template: TemplateResponse) -> Response:
+    # Already a validated TemplateResponse: serialize it straight to JSON
+    # instead of letting response_model dump and re-validate it.
+    return Response(content=template.model_dump_json(), media_type="application/json")
 
 # ------------------ CREATE A VM TEMPLATE (Admins Only) ------------------
 @router.post("/", response_model=TemplateResponse)
-async def create_vm_template(template: TemplateCreate, token=Depends(verify_token)):
+async def create_vm_template(template: TemplateCreate, user: CurrentUser):
     """Create a new VM template. Only admins can create."""
-    user = await get_user_from_token(token)
     if not user["is_admin"]:
         raise HTTPException(status_code=403, detail="Only admins can create VM templates")
 
@@ -39,16 +32,15 @@ async def create_vm_template(template: TemplateCreate, token=Depends(verify_toke
         max_space=template.max_space,
         qemu_image=template.qemu_image,
         created_by=user["id"],  # Use user ID from DB
-        created_at=datetime.utcnow()
-    )
-    template_id = await database.execute(query)
+    ).returning(templates.c.id, templates.c.created_at)
+    created = await database.fetch_one(query)
 
-    return {
-        **template.dict(),
-        "id": template_id,
-        "created_by": user["id"],
-        "created_at": datetime.utcnow()
-    }
+    return template_json_response(TemplateResponse(
+        **template.model_dump(),
+        id=created["id"],
+        created_by=user["id"],
+        created_at=created["created_at"],
+    ))
 
 # ------------------ LIST ALL VM TEMPLATES ------------------
 # ------------------ LIST & SEARCH VM TEMPLATES ------------------
@@ -72,8 +64,8 @@ async def list_or_search_templates(
             )
         )
 
-    result = await database.fetch_all(search_query)
-    return [dict(row) for row in result]
+    # Rows are validated by attribute (from_attributes), no per-row dict copy
+    return await database.fetch_all(search_query)
 
 # ------------------ GET A SINGLE VM TEMPLATE ------------------
 @router.get("/{template_id}", response_model=TemplateResponse)
@@ -85,24 +77,16 @@ async def get_vm_template(template_id: int):
     if not result:
         raise HTTPException(status_code=404, detail="VM Template not found")
 
-    return {
-        **dict(result)
-    }
+    return result
 
 # ------------------ UPDATE A VM TEMPLATE (Admins Only) ------------------
 @router.put("/{template_id}", response_model=TemplateResponse)
-async def update_vm_template(template_id: int, template: TemplateCreate, token=Depends(verify_token)):
+async def update_vm_template(template_id: int, template: TemplateCreate, user: CurrentUser):
     """Update a VM template. Only admins can update."""
-    user = await get_user_from_token(token)
     if not user["is_admin"]:
         raise HTTPException(status_code=403, detail="Only admins can update VM templates")
 
-    query = templates.select().where(templates.c.id == template_id)
-    existing_template = await database.fetch_one(query)
-
-    if not existing_template:
-        raise HTTPException(status_code=404, detail="VM Template not found")
-
+    # One round-trip: a missing template updates nothing and returns no row
     query = (
         templates.update()
         .where(templates.c.id == template_id)
@@ -115,31 +99,28 @@ async def update_vm_template(template_id: int, template: TemplateCreate, token=D
             max_space=template.max_space,
             qemu_image=template.qemu_image,
         )
+        .returning(*templates.c)
     )
-    await database.execute(query)
+    updated_template = await database.fetch_one(query)
+
+    if not updated_template:
+        raise HTTPException(status_code=404, detail="VM Template not found")
+    invalidate_template(template_id)
 
-    return {
-        **template.dict(),
-        "id": template_id,
-        "created_by": existing_template["created_by"],
-        "created_at": existing_template["created_at"]
-    }
+    return template_json_response(TemplateResponse.model_validate(updated_template))
 
 # ------------------ DELETE A VM TEMPLATE (Admins Only) ------------------
 @router.delete("/{template_id}")
-async def delete_vm_template(template_id: int, token=Depends(verify_token)):
+async def delete_vm_template(template_id: int, user: CurrentUser):
     """Delete a VM template. Only admins can delete."""
-    user = await get_user_from_token(token)
     if not user["is_admin"]:
         raise HTTPException(status_code=403, detail="Only admins can delete VM templates")
 
-    query = templates.select().where(templates.c.id == template_id)
-    existing_template = await database.fetch_one(query)
+    query = templates.delete().where(templates.c.id == template_id).returning(templates.c.id)
+    deleted_template = await database.fetch_one(query)
 
-    if not existing_template:
+    if not deleted_template:
         raise HTTPException(status_code=404, detail="VM Template not found")
-
-    query = templates.delete().where(templates.c.id == template_id)
-    await database.execute(query)
+    invalidate_template(template_id)
 
     return {"message": "VM Template deleted successfully"}
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from typing import Optional
+
+import orjson
+
+from app.core.kube import kube_client, WATCH_TIMEOUT
+from app.core.variables import KUBERNETES_API_URL, NAMESPACE
+
+logger = logging.getLogger(__name__)
+
+# ------------------ Watch-Backed Object Caches ------------------
+# Each informer lists one resource in NAMESPACE once, then follows a watch
+# from the list's resourceVersion, so reads are memory lookups instead of
+# API server calls. Until the first list succeeds (or after the watch
+# breaks) `synced` is False and callers fall back to live GETs.
+INFORMER_RETRY_INTERVAL = 5  # seconds
+INFORMER_PAGE_SIZE = 500
+
+
+class Informer:
+    def __init__(self, path: str):
+        self.url = f"{KUBERNETES_API_URL}{path}"
+        self.objects: dict = {}
+        self.synced = False
+
+    def get(self, name: str) -> Optional[dict]:
+        return self.objects.get(name)
+
+    async def run(self):
+        while True:
+            try:
+                resource_version = await self._list()
+                await self._watch(resource_version)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.synced = False
+                logger.warning("Informer for %s failed, relisting: %s", self.url, e)
+                await asyncio.sleep(INFORMER_RETRY_INTERVAL)
+
+    async def _list(self) -> str:
+        # Listed in pages, so a large namespace is never one giant body;
+        # every page belongs to the snapshot of the first
+        objects = {}
+        params = {"limit": INFORMER_PAGE_SIZE}
+        while True:
+            response = await kube_client.get(self.url, params=params)
+            response.raise_for_status()
+            listing = orjson.loads(response.content)
+            for item in listing.get("items", ()):
+                objects[item["metadata"]["name"]] = item
+            continue_token = listing["metadata"].get("continue")
+            if not continue_token:
+                break
+            params = {"limit": INFORMER_PAGE_SIZE, "continue": continue_token}
+        # Swapped in whole, so readers never see a half-built map
+        self.objects = objects
+        self.synced = True
+        return listing["metadata"]["resourceVersion"]
+
+    async def _watch(self, resource_version: str):
+        params = {"watch": "true", "resourceVersion": resource_version}
+        async with kube_client.stream("GET", self.url, params=params, timeout=WATCH_TIMEOUT) as stream:
+            stream.raise_for_status()
+            async for line in stream.aiter_lines():
+                if not line:
+                    continue
+                event = orjson.loads(line)
+                event_type, obj = event["type"], event["object"]
+                if event_type == "ADDED" or event_type == "MODIFIED":
+                    self.objects[obj["metadata"]["name"]] = obj
+                elif event_type == "DELETED":
+                    self.objects.pop(obj["metadata"]["name"], None)
+                elif event_type == "ERROR":
+                    return  # e.g. 410 Gone: relist
+        # The server ended the watch; the caller relists
+
+
+vm_informer = Informer(f"/apis/kubevirt.io/v1/namespaces/{NAMESPACE}/virtualmachines")
+pvc_informer = Informer(f"/api/v1/namespaces/{NAMESPACE}/persistentvolumeclaims")
+snapshot_informer = Informer(f"/apis/snapshot.kubevirt.io/v1alpha1/namespaces/{NAMESPACE}/virtualmachinesnapshots")
+
+_informer_tasks = []
+
+
+def start_informers():
+    for informer in (vm_informer, pvc_informer, snapshot_informer):
+        _informer_tasks.append(asyncio.ensure_future(informer.run()))
+
+
+async def stop_informers():
+    for task in _informer_tasks:
+        task.cancel()
+    await asyncio.gather(*_informer_tasks, return_exceptions=True)
+    _informer_tasks.clear()
@@ -1,44 +1,90 @@
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, HTTPException, Response, WebSocket, WebSocketDisconnect
+from starlette.websockets import WebSocketState
 from app.db.database import database
-from app.db.models import users, vm_instances, templates, vm_costs
-from app.core.security import verify_token, ws_token_to_jwt
+from app.db.models import vm_instances, templates, vm_costs
+from sqlalchemy import bindparam, func, insert, select
+from app.core.security import ws_token_to_jwt
+from app.core.cache import get_cached_template_caps, cache_template_caps
+from app.core.deps import CurrentUser, get_user_from_token
+from app.core.kube import kube_client, kube_get, get_ws_session, WS_CONNECT_OPTIONS
 from app.vms.schemas import *
 from app.vms.services import *
 from app.vms.snapservices import *
-from typing import List, Optional
+from app.core.variables import KUBERNETES_API_URL, KUBERNATES_WS_URL
+from pydantic import BaseModel, ConfigDict, TypeAdapter
+from typing import List, NamedTuple, Optional
 from datetime import datetime
-import httpx
 import aiohttp
 import asyncio
+import orjson
+import logging
 import re
+import time
+from functools import lru_cache
+from types import MappingProxyType
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Merge patch for a resize; only the CPU cores and memory (Gi) vary
+VM_RESIZE_PATCH = (
+    b'{"spec":{"template":{"spec":{"domain":{'
+    b'"cpu":{"cores":%d},'
+    b'"resources":{"requests":{"memory":"%dGi"}}'
+    b'}}}}}'
+)
+MERGE_PATCH_HEADERS = MappingProxyType({b"Content-Type": b"application/merge-patch+json"})
+
+# Statements built once; each request only binds its parameters
+_VM_BY_ID = select(vm_instances).where(vm_instances.c.id == bindparam("id"))
+_TEMPLATE_CAPS_BY_ID = select(templates.c.max_cpu, templates.c.max_ram).where(templates.c.id == bindparam("id"))
+
+# Kubernetes API URLs, prefixed once; only the object names vary per call
+PODS_URL = f"{KUBERNETES_API_URL}/api/v1/namespaces/{{namespace}}/pods"
+POD_METRICS_URL = f"{KUBERNETES_API_URL}/apis/metrics.k8s.io/v1beta1/namespaces/{{namespace}}/pods"
+NODE_METRICS_URL = f"{KUBERNETES_API_URL}/apis/metrics.k8s.io/v1beta1/nodes"
+VM_URL = f"{KUBERNETES_API_URL}/apis/kubevirt.io/v1/namespaces/{{namespace}}/virtualmachines/{{name}}"
+VM_RESTART_URL = f"{KUBERNETES_API_URL}/apis/subresources.kubevirt.io/v1/namespaces/{{namespace}}/virtualmachines/{{name}}/restart"
+VMI_URL = f"{KUBERNETES_API_URL}/apis/kubevirt.io/v1/namespaces/{{namespace}}/virtualmachineinstances/{{name}}"
+# resourceVersion=0 lets the API server answer from its watch cache
+# instead of a quorum read from etcd; fine for status that is polled anyway
+CACHED_READ = MappingProxyType({"resourceVersion": "0"})
+# Label carried by the virt-launcher pod of every VM
+VM_POD_LABEL = "vm.kubevirt.io/name"
+VNC_URL = f"{KUBERNATES_WS_URL}/apis/subresources.kubevirt.io/v1/namespaces/{{namespace}}/virtualmachineinstances/{{name}}/vnc"
+
+
+@lru_cache(maxsize=1024)
+def vm_pod_params(vm_name: str) -> MappingProxyType:
+    """Query selecting the virt-launcher pod of a VM; built once per VM name."""
+    return MappingProxyType({"labelSelector": f"{VM_POD_LABEL}={vm_name}"})
 
 # ------------------ Metrics Parsing Helpers ------------------
+# Suffix lookups: nanocores/microcores/millicores -> millicores, and
+# binary memory units -> Ki
+_CPU_DIVISORS = {"n": 1_000_000, "u": 1000, "m": 1}
+_MEM_MULTIPLIERS = {"Ki": 1, "Mi": 1024, "Gi": 1024 * 1024, "Ti": 1024 ** 3}
+
 def parse_cpu_usage(cpu_str: str) -> int:
     """
     Convert CPU usage string to millicores as integer.
-    E.g., "500m" -> 500, "1" -> 1000.
+    E.g., "500m" -> 500, "1" -> 1000, "250000000n" -> 250.
     """
-    if cpu_str.endswith("m") or cpu_str.endswith("n"):
-        return int(cpu_str[:-1])
-    else:
-        return int(float(cpu_str) * 1000)
+    divisor = _CPU_DIVISORS.get(cpu_str[-1])
+    if divisor:
+        return int(cpu_str[:-1]) // divisor
+    return int(float(cpu_str) * 1000)
 
 def parse_memory_usage(mem_str: str) -> int:
     """
     Convert memory usage string to Ki (integer).
     E.g., "256Mi" -> 256*1024, "1Gi" -> 1*1024*1024.
     """
-    if mem_str.endswith("Ki"):
-        return int(mem_str[:-2])
-    elif mem_str.endswith("Mi"):
-        return int(mem_str[:-2]) * 1024
-    elif mem_str.endswith("Gi"):
-        return int(mem_str[:-2]) * 1024 * 1024
-    else:
-        # fallback: assume value is already in Ki
-        return int(mem_str)
+    multiplier = _MEM_MULTIPLIERS.get(mem_str[-2:])
+    if multiplier:
+        return int(mem_str[:-2]) * multiplier
+    # fallback: assume value is already in Ki
+    return int(mem_str)
 
 
 class NodeMetrics(BaseModel):
@@ -56,15 +102,13 @@ async def get_vm_pod_name(namespace: str, vm_name: str) -> str:
     """
     Fetch the pod name for a VM by querying Kubernetes with the correct label selector.
     """
-    url = f"{KUBERNETES_API_URL}/api/v1/namespaces/{namespace}/pods"
-    params = {"labelSelector": f"vm.kubevirt.io/name={vm_name}"}
-    async with httpx.AsyncClient(verify=False) as client:
-        response = await client.get(url, headers=HEADERS, params=params)
+    url = PODS_URL.format(namespace=namespace)
+    response = await kube_get(url, params=vm_pod_params(vm_name))
 
     if response.status_code != 200:
         raise HTTPException(status_code=response.status_code, detail="Failed to fetch VM pod")
 
-    pods = response.json().get("items", [])
+    pods = orjson.loads(response.content).get("items", [])
     if not pods:
         raise HTTPException(status_code=404, detail=f"No pod found for VM {vm_name}")
 
@@ -75,65 +119,105 @@ async def get_vm_pod_name(namespace: str, vm_name: str) -> str:
 async def fetch_k8s_vm_metrics(namespace: str, vm_name: str) -> VMMetrics:
     """
     Fetch metrics for a VM pod using Metrics Server.
-    """
-    try:
-        pod_name = await get_vm_pod_name(namespace, vm_name)
-    except HTTPException as e:
-        raise HTTPException(status_code=e.status_code, detail=f"Failed to fetch VM pod: {e.detail}")
 
-    metrics_url = f"{KUBERNETES_API_URL}/apis/metrics.k8s.io/v1beta1/namespaces/{namespace}/pods/{pod_name}"
-    async with httpx.AsyncClient(verify=False) as client:
-        metrics_response = await client.get(metrics_url, headers=HEADERS)
+    The pod is selected by label in the same request, so no separate pod
+    lookup is needed.
+    """
+    metrics_url = POD_METRICS_URL.format(namespace=namespace)
+    metrics_response = await kube_get(metrics_url, params=vm_pod_params(vm_name))
 
     if metrics_response.status_code != 200:
         raise HTTPException(status_code=metrics_response.status_code, detail="Metrics unavailable")
 
-    metrics_data = metrics_response.json()
-    containers = metrics_data.get("containers", [])
-
-    # Sum usage across all containers in the pod using the new helpers
-    total_cpu = sum(parse_cpu_usage(c["usage"]["cpu"]) for c in containers)
-    total_memory_ki = sum(parse_memory_usage(c["usage"]["memory"]) for c in containers)
-
-    # Format the CPU and memory usage strings
-    cpu_usage_str = f"{total_cpu}m"
-    memory_usage_str = f"{total_memory_ki // 1024}Mi"
-
+    pods = orjson.loads(metrics_response.content).get("items", [])
+    if not pods:
+        raise HTTPException(status_code=404, detail=f"No pod metrics found for VM {vm_name}")
+    usage = sum_pod_usage(pods[0].get("containers", []))
     return VMMetrics(
-        cpu_usage=cpu_usage_str,
-        memory_usage=memory_usage_str
+        cpu_usage=f"{usage.cpu_millicores}m",
+        memory_usage=f"{usage.memory_ki // 1024}Mi"
     )
 
+
+class PodUsage(NamedTuple):
+    cpu_millicores: int
+    memory_ki: int
+
+
+def sum_pod_usage(containers: list) -> PodUsage:
+    # Sum usage across all containers in the pod in one pass
+    # (bound locally, this runs for every container of every VM pod)
+    cpu, memory = parse_cpu_usage, parse_memory_usage
+    total_cpu = total_memory_ki = 0
+    for container in containers:
+        usage = container["usage"]
+        total_cpu += cpu(usage["cpu"])
+        total_memory_ki += memory(usage["memory"])
+
+    # Plain numbers; callers format them for their response model
+    return PodUsage(total_cpu, total_memory_ki)
+
+
+# ------------------ Fleet Metrics Snapshot ------------------
+# One list of VM pod metrics per namespace, shared by every /metrics poll
+# for a few seconds, instead of one Metrics Server call per VM per poll.
+# Metrics Server itself only refreshes about every 15s. Listing per
+# namespace keeps the service account on namespaced metrics access.
+FLEET_METRICS_TTL = 15
+VM_POD_SELECTOR = MappingProxyType({"labelSelector": VM_POD_LABEL})
+_vm_metrics_by_namespace: dict = {}  # namespace -> (fetched at, usage by VM name)
+_vm_metrics_locks: dict = {}
+
+
+async def get_namespace_vm_metrics(namespace: str) -> dict:
+    """PodUsage of every running VM in a namespace, keyed by VM name."""
+    cached = _vm_metrics_by_namespace.get(namespace)
+    if cached and time.monotonic() - cached[0] < FLEET_METRICS_TTL:
+        return cached[1]
+
+    # Single flight: concurrent polls wait for the one refresh in progress
+    lock = _vm_metrics_locks.get(namespace)
+    if lock is None:
+        lock = _vm_metrics_locks[namespace] = asyncio.Lock()
+    async with lock:
+        cached = _vm_metrics_by_namespace.get(namespace)
+        if cached and time.monotonic() - cached[0] < FLEET_METRICS_TTL:
+            return cached[1]
+
+        response = await kube_get(POD_METRICS_URL.format(namespace=namespace), params=VM_POD_SELECTOR)
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail="Metrics unavailable")
+
+        usages = {}
+        for pod in orjson.loads(response.content).get("items", []):
+            vm_name = pod["metadata"].get("labels", {}).get(VM_POD_LABEL)
+            if vm_name:
+                usages[vm_name] = sum_pod_usage(pod.get("containers", []))
+
+        _vm_metrics_by_namespace[namespace] = (time.monotonic(), usages)
+        return usages
+
 # Add new response model
 class VMMetricItem(VMMetrics):
     vm_id: int
     vm_name: str
 
-# ------------------ Helper: Fetch User from DB ------------------
-async def get_user_from_token(decoded_token: dict):
-    """Fetch user details from DB based on JWT token (sub=username)."""
-    query = users.select().where(users.c.username == decoded_token["sub"])
-    user = await database.fetch_one(query)
-
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-
-    return dict(user)  # Convert row to dictionary
-
-
 # ------------------ LIST VMs ------------------
+VM_LIST_ADAPTER = TypeAdapter(List[VirtualMachineResponse])
+
 @router.get("/", response_model=List[VirtualMachineResponse])
-async def list_vms_endpoint(token=Depends(verify_token)):
+async def list_vms_endpoint(user: CurrentUser):
     """List all VM instances from DB and check their status in Kubernetes."""
-    user = await get_user_from_token(token)
-    return await list_vms(user)
+    # Encoded in pydantic-core directly, so FastAPI doesn't dump and
+    # re-validate every item against response_model
+    vms = await list_vms(user)
+    return Response(content=VM_LIST_ADAPTER.dump_json(vms), media_type="application/json")
 
 
 # ------------------ CREATE A VM ------------------
 @router.post("/", response_model=VirtualMachineResponse)
-async def create_vm_endpoint(vm: CreateVM, token=Depends(verify_token)):
+async def create_vm_endpoint(vm: CreateVM, user: CurrentUser):
     """Create a new Virtual Machine based on a template."""
-    user = await get_user_from_token(token)
     return await create_vm(vm, user)
     
     
@@ -141,32 +225,30 @@ async def create_vm_endpoint(vm: CreateVM, token=Depends(verify_token)):
 
 
 @router.get("/nodemetrics", response_model=List[NodeMetrics])
-async def get_node_metrics(token=Depends(verify_token)):
+async def get_node_metrics(user: CurrentUser):
     """
     Fetch metrics for all nodes in the cluster.
     """
-    user = await get_user_from_token(token)
     if not user["is_admin"]:
         raise HTTPException(status_code=403, detail="Only admins can view node metrics")
 
-    metrics_url = f"{KUBERNETES_API_URL}/apis/metrics.k8s.io/v1beta1/nodes"
-    async with httpx.AsyncClient(verify=False) as client:
-        metrics_response = await client.get(metrics_url, headers=HEADERS)
+    metrics_url = NODE_METRICS_URL
+    metrics_response = await kube_get(metrics_url)
 
     if metrics_response.status_code != 200:
         raise HTTPException(status_code=metrics_response.status_code, detail="Failed to fetch node metrics")
 
-    metrics_data = metrics_response.json()
-    node_metrics = []
-
-    for node in metrics_data["items"]:
-        node_metrics.append(NodeMetrics(
-            node_name=node["metadata"]["name"],
-            cpu_usage=node["usage"]["cpu"],
-            memory_usage=node["usage"]["memory"]
-        ))
+    metrics_data = orjson.loads(metrics_response.content)
 
-    return node_metrics
+    # Plain dicts: response_model validates each item once, on the way out
+    return [
+        {
+            "node_name": node["metadata"]["name"],
+            "cpu_usage": node["usage"]["cpu"],
+            "memory_usage": node["usage"]["memory"],
+        }
+        for node in metrics_data["items"]
+    ]
 
 
 # Update the VMMetricItem model
@@ -176,70 +258,96 @@ class VMMetricItem(VMMetrics):
     last_cost: Optional[int] = None
     last_cost_timestamp: Optional[datetime] = None
 
+# Latest cost record of each listed VM in one query: rank every VM's
+# records newest first (served by ix_vm_costs_vm_instance_id_recorded_at)
+# and keep rank 1. ROW_NUMBER works on both SQLite and Postgres. SQLite
+# stamps whole seconds, so the id breaks ties between records written in
+# the same second (e.g. a create followed by a quick resize).
+_ranked_costs = select(
+    vm_costs.c.vm_instance_id,
+    vm_costs.c.cost_per_hour,
+    vm_costs.c.recorded_at,
+    func.row_number().over(
+        partition_by=vm_costs.c.vm_instance_id,
+        order_by=(vm_costs.c.recorded_at.desc(), vm_costs.c.id.desc()),
+    ).label("recency"),
+).where(vm_costs.c.vm_instance_id.in_(bindparam("vm_ids", expanding=True))).subquery()
+_LATEST_COSTS = select(
+    _ranked_costs.c.vm_instance_id, _ranked_costs.c.cost_per_hour, _ranked_costs.c.recorded_at
+).where(_ranked_costs.c.recency == 1)
+
 # Modified metrics endpoint
 @router.get("/metrics", response_model=List[VMMetricItem])
-async def get_vm_metrics_list(token=Depends(verify_token)):
+async def get_vm_metrics_list(user: CurrentUser):
     """
     Get metrics for all VMs owned by the current user
     (returns all VMs if user is admin)
     """
-    user = await get_user_from_token(token)
-    vms_list = await list_vms(user)
-    
+    # Only the DB rows are needed: usage comes from the metrics snapshots, so
+    # list_vms' per-VM Kubernetes status calls would be wasted
+    owned_vms = await list_vm_rows(user)
+    if not owned_vms:
+        return []
+
+    # Usage comes from the shared per-namespace snapshots (usually just
+    # NAMESPACE); the cost query runs meanwhile
+    costs = asyncio.ensure_future(
+        database.fetch_all(_LATEST_COSTS.params(vm_ids=[vm["id"] for vm in owned_vms]))
+    )
+    namespaces = list({vm["namespace"] for vm in owned_vms})
+    results = await asyncio.gather(
+        *(get_namespace_vm_metrics(namespace) for namespace in namespaces), return_exceptions=True
+    )
+    usage_by_namespace = {}
+    for namespace, result in zip(namespaces, results):
+        if isinstance(result, HTTPException):
+            logger.warning("Skipping VMs in %s due to error: %s", namespace, result.detail)
+            result = {}
+        elif isinstance(result, Exception):
+            logger.warning("Unexpected error fetching VM metrics for %s: %s", namespace, result)
+            result = {}
+        usage_by_namespace[namespace] = result
+    latest_costs = {record["vm_instance_id"]: record for record in await costs}
+
     metrics_list = []
-    
-    for vm in vms_list:
-        # Filter VMs for non-admins
-        if not user["is_admin"] and vm.user_id != user["id"]:
+    for vm in owned_vms:
+        usage = usage_by_namespace[vm["namespace"]].get(vm["name"])
+        if usage is None:
+            logger.warning("Skipping VM %s due to error: no pod metrics", vm["name"])
             continue
-            
-        try:
-            vm_metrics = await fetch_k8s_vm_metrics(vm.namespace, vm.name)
-            
-            # Get latest cost record
-            query = vm_costs.select().where(vm_costs.c.vm_instance_id == vm.id)\
-                        .order_by(vm_costs.c.recorded_at.desc()).limit(1)
-            cost_record = await database.fetch_one(query)
-            
-            metrics_list.append(VMMetricItem(
-                vm_id=vm.id,
-                vm_name=vm.name,
-                cpu_usage=vm_metrics.cpu_usage,
-                memory_usage=vm_metrics.memory_usage,
-                last_cost=cost_record.cost_per_hour if cost_record else None,
-                last_cost_timestamp=cost_record.recorded_at if cost_record else None
-            ))
-        except HTTPException as e:
-            print(f"Skipping VM {vm.name} due to error: {e.detail}")
-        except Exception as e:
-            print(f"Unexpected error with VM {vm.name}: {str(e)}")
-    
+
+        cost_record = latest_costs.get(vm["id"])
+
+        # Plain dicts, as in /nodemetrics: response_model validates each
+        # item once on the way out instead of building it twice
+        metrics_list.append({
+            "vm_id": vm["id"],
+            "vm_name": vm["name"],
+            "cpu_usage": f"{usage.cpu_millicores}m",
+            "memory_usage": f"{usage.memory_ki // 1024}Mi",
+            "last_cost": cost_record["cost_per_hour"] if cost_record else None,
+            "last_cost_timestamp": cost_record["recorded_at"] if cost_record else None,
+        })
+
     return metrics_list
 
 
 # ------------------ GET A VM ------------------
 @router.get("/{id}", response_model=VirtualMachineResponse)
-async def get_vm_endpoint(id: int, token=Depends(verify_token)):
+async def get_vm_endpoint(id: int, user: CurrentUser):
     """Fetch VM data from DB and verify its existence in Kubernetes."""
-    user = await get_user_from_token(token)
     return await get_vm(id, user)
 
 # ------------------ DELETE A VM ------------------
 @router.delete("/{id}")
-async def delete_vm_endpoint(id: int, token=Depends(verify_token)):
+async def delete_vm_endpoint(id: int, user: CurrentUser):
     """Delete a VM from both DB and Kubernetes."""
-    user = await get_user_from_token(token)
     return await delete_vm(id, user)
 
 @router.patch("/{id}", response_model=VirtualMachineResponse)
-async def patch_vm_endpoint(id: int, vm_patch: PatchVM, token=Depends(verify_token)):
+async def patch_vm_endpoint(id: int, vm_patch: PatchVM, user: CurrentUser):
     """Patch the resources of a VM instance. Only the VM owner or an admin can modify it."""
-    # Fetch user
-    user = await get_user_from_token(token)
-
-    # Fetch VM data
-    query = select(vm_instances).where(vm_instances.c.id == id)
-    vm = await database.fetch_one(query)
+    vm = await database.fetch_one(_VM_BY_ID.params(id=id))
 
     if not vm:
         raise HTTPException(status_code=404, detail="VM not found")
@@ -249,133 +357,96 @@ async def patch_vm_endpoint(id: int, vm_patch: PatchVM, token=Depends(verify_tok
         raise HTTPException(status_code=403, detail="Not authorized to edit this VM")
 
     # Fetch the template to get max resources
-    template_query = select(templates).where(templates.c.id == vm["template_id"])
-    template = await database.fetch_one(template_query)
+    template = get_cached_template_caps(vm["template_id"])
+    if template is None:
+        template = await database.fetch_one(_TEMPLATE_CAPS_BY_ID.params(id=vm["template_id"]))
 
-    if not template:
-        raise HTTPException(status_code=404, detail="Template not found")
+        if not template:
+            raise HTTPException(status_code=404, detail="Template not found")
+        template = cache_template_caps(vm["template_id"], template)
 
-    # Apply resource constraints using the min_abs function
-    updated_cpu = min_abs(template["max_cpu"], vm_patch.cpu) if vm_patch.cpu else vm["cpu"]
-    updated_ram = min_abs(template["max_ram"], vm_patch.ram) if vm_patch.ram else vm["ram"]
+    # Clamp the requested resources to the template's maximums
+    updated_cpu = min(template["max_cpu"], vm_patch.cpu) if vm_patch.cpu else vm["cpu"]
+    updated_ram = min(template["max_ram"], vm_patch.ram) if vm_patch.ram else vm["ram"]
 
-    # Step 1: Fetch the current VM configuration from Kubernetes
-    url = f"{KUBERNETES_API_URL}/apis/kubevirt.io/v1/namespaces/{vm.namespace}/virtualmachines/{vm.name}"
-    async with httpx.AsyncClient(verify=False) as client:
-        response = await client.get(url, headers=HEADERS)
-
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=f"Failed to fetch VM from Kubernetes: {response.text}")
-    
-    current_vm = response.json()
-    resource_version = current_vm['metadata']['resourceVersion']  # Get the current resourceVersion
-
-    # Step 2: Prepare the updated VM configuration, preserving the existing devices, volumes, etc.
-    updated_vm_config = {
-        "apiVersion": "kubevirt.io/v1",  # Set the API version to kubevirt.io/v1
-        "kind": "VirtualMachine",  # Define the kind of the resource
-        "metadata": {
-            "name": vm["name"],  # Ensure the VM name is included in the metadata
-            "namespace": vm["namespace"],  # Include the namespace
-            "resourceVersion": resource_version  # Include the resourceVersion here
-        },
-        "spec": {
-            "running": True,  # Ensure the VM is running after the update, or set to False to stop
-            "template": {
-                "spec": {
-                    "domain": {
-                        "cpu": {
-                            "cores": updated_cpu  # Update CPU cores
-                        },
-                        "resources": {
-                            "requests": {
-                                "memory": f"{updated_ram}Gi"  # Update RAM in Gi
-                            }
-                        },
-                        "devices": current_vm['spec']['template']['spec']['domain'].get('devices', []),  # Preserve devices
-                    },
-                    # Preserve the rest of the spec (volumes, networks, etc.)
-                    "networks": current_vm['spec']['template']['spec'].get('networks', []),  # Attach to bridge network
-                    "volumes": current_vm['spec']['template']['spec'].get('volumes', []),
-                }
-            }
-        }
-    }
-
-    # Step 3: Update the VM in Kubernetes
-    async with httpx.AsyncClient(verify=False) as client:
-        response = await client.put(url, json=updated_vm_config, headers=HEADERS)
-        print(response.text)
+    # Step 1: Update the VM in Kubernetes with a JSON merge patch carrying
+    # only the changed fields; no GET, no resourceVersion, and devices,
+    # volumes and networks are left untouched server-side.
+    url = VM_URL.format(namespace=vm["namespace"], name=vm["name"])
+    vm_patch_body = VM_RESIZE_PATCH % (updated_cpu, updated_ram)
+    response = await kube_client.patch(url, content=vm_patch_body, headers=MERGE_PATCH_HEADERS)
 
     if response.status_code != 200:
         raise HTTPException(status_code=response.status_code, detail=f"Failed to update VM in Kubernetes: {response.text}")
 
-    # Step 4: Restart the VM by triggering a restart operation using KubeVirt API
-    # Step 1: Create the API URL to restart the VM
-    print(vm)
-    restart_url = f"{KUBERNETES_API_URL}/apis/subresources.kubevirt.io/v1/namespaces/{vm['namespace']}/virtualmachines/{vm['name']}/restart"
-
-    # Step 2: Restart the VM (POST request)
-    async with httpx.AsyncClient(verify=False) as client:
-        restart_response = await client.put(restart_url, headers=HEADERS)
-
-    # Step 3: Check for any issues with the restart request
-    if restart_response.status_code != 202:
-        raise HTTPException(status_code=restart_response.status_code, detail=f"Failed to restart VM in Kubernetes: {restart_response.text}")
-
+    # Step 2: Restart the VM so the new resources apply
+    restart_url = VM_RESTART_URL.format(namespace=vm["namespace"], name=vm["name"])
+    restart_response = await kube_client.put(restart_url)
 
-    # Add cost logging after resource update
+    # The cost of the new allocation is logged once the spec has changed,
+    # on every path from here on
     cost = calculate_cost(updated_cpu, updated_ram)
     query = insert(vm_costs).values(
         vm_instance_id=id,
         cpu_cores=updated_cpu,
         ram_gb=updated_ram,
         cost_per_hour=cost,
-        recorded_at=datetime.utcnow(),
     )
-    await database.execute(query)
 
-    # Step 5: Return the updated VM details
-    kube_status = await check_vm_in_kube(vm["namespace"], vm["name"])
-    return VirtualMachineResponse(**dict(vm), kube_status=kube_status)
+    # Step 3: Check for any issues with the restart request
+    if restart_response.status_code != 202:
+        # The new spec is already stored, so its cost is too
+        await database.execute(query)
+        raise HTTPException(status_code=restart_response.status_code, detail=f"Failed to restart VM in Kubernetes: {restart_response.text}")
+
+    # Started before anything else can raise, so the row is written even
+    # if building the status below fails
+    cost_written = asyncio.ensure_future(database.execute(query))
+
+    # Step 4: Return the updated VM details. The PATCH answered with the
+    # updated VirtualMachine; the watch cache may not have seen it yet.
+    invalidate_vm_status(vm["namespace"], vm["name"])
+    try:
+        kube_status = await vm_status_from_object(vm["namespace"], orjson.loads(response.content))
+    finally:
+        # Awaited on every path, so a failed insert surfaces instead of
+        # being left as an unretrieved task exception
+        await cost_written
+    return VirtualMachineResponse.model_validate({**vm._mapping, "kube_status": kube_status})
 
 
 @router.post("/{vm_id}/snapshots/", response_model=VMSnapshot)
-async def create_vm_snapshot(vm_id: int, token=Depends(verify_token)):
+async def create_vm_snapshot(vm_id: int, user: CurrentUser):
     """
     Create a snapshot for a given VM. The snapshot is created in Kubernetes and recorded in the DB.
     """
-    user = await get_user_from_token(token)
     snapshot = await create_snapshot(vm_id, user)
     return snapshot
 
 
 @router.get("/{vm_id}/snapshots/", response_model=list[VMSnapshot])
-async def list_vm_snapshots(vm_id: int, token=Depends(verify_token)):
+async def list_vm_snapshots(vm_id: int, user: CurrentUser):
     """
     List all snapshots for a given VM. Each snapshot’s status is fetched from Kubernetes.
     """
-    user = await get_user_from_token(token)
     snapshots = await get_snapshots(vm_id, user)
     return snapshots
 
 
 @router.get("/{vm_id}/snapshots/{snap_id}", response_model=VMSnapshot)
-async def get_vm_snapshot(vm_id: int, snap_id: int, token=Depends(verify_token)):
+async def get_vm_snapshot(vm_id: int, snap_id: int, user: CurrentUser):
     """
     Get detailed information about a specific snapshot by its database ID.
     """
-    user = await get_user_from_token(token)
     snapshot = await get_snapshot_details(vm_id, snap_id, user)
     return snapshot
 
 
 @router.delete("/{vm_id}/snapshots/{snap_id}", response_model=dict)
-async def delete_vm_snapshot(vm_id: int, snap_id: int, token=Depends(verify_token)):
+async def delete_vm_snapshot(vm_id: int, snap_id: int, user: CurrentUser):
     """
     Delete a specific snapshot by its database ID from Kubernetes and remove its record from the database.
     """
-    user = await get_user_from_token(token)
     result = await delete_snapshot(vm_id, snap_id, user)
     return result
 
@@ -386,16 +457,26 @@ class VMCostRecord(BaseModel):
     ram_gb: int
     cost_per_hour: int
 
+    model_config = ConfigDict(from_attributes=True)
+
+COSTS_ADAPTER = TypeAdapter(List[VMCostRecord])
+# Only the columns the response carries
+COST_COLUMNS = [vm_costs.c[field] for field in VMCostRecord.model_fields]
+_COSTS_BY_VM = select(*COST_COLUMNS).where(vm_costs.c.vm_instance_id == bindparam("vm_id"))
+
 @router.get("/{id}/costs", response_model=List[VMCostRecord])
-async def get_vm_costs(id: int, token=Depends(verify_token)):
-    print(f"incoming req with id {id}")
-    user = await get_user_from_token(token)
-    vm = await get_vm(id, user)  # Reuse existing auth check
+async def get_vm_costs(id: int, user: CurrentUser):
+    logger.debug("incoming req with id %s", id)
+    # Ownership only needs the DB row, not get_vm's Kubernetes status call
+    vm = await fetch_vm_row(id)
+    authorize_vm(vm, user)
     
-    query = vm_costs.select().where(vm_costs.c.vm_instance_id == id)
-    records = await database.fetch_all(query)
+    records = await database.fetch_all(_COSTS_BY_VM.params(vm_id=id))
     
-    return [dict(record) for record in records] if records else []
+    # Validate the records by attribute and encode them in pydantic-core,
+    # without FastAPI's second response_model pass
+    costs = COSTS_ADAPTER.validate_python(records, from_attributes=True)
+    return Response(content=COSTS_ADAPTER.dump_json(costs), media_type="application/json")
 
 
 class SocketProxyInfo(BaseModel):
@@ -412,84 +493,158 @@ async def websocket_vnc_proxy(websocket: WebSocket, id: int):
     """
     await websocket.accept()
 
-    # Extract and validate the token
-    query_params = websocket.query_params
-    token = ws_token_to_jwt(str(query_params).split("=")[1])
-    user = await get_user_from_token(token)
-
-    # Fetch VM details
-    vm = await get_vm(id, user)
-    if not vm:
-        await websocket.close(code=1008, reason="VM not found")
+    # Extract and validate the token (?token=<jwt>)
+    raw_token = websocket.query_params.get("token")
+    if not raw_token:
+        await websocket.close(code=1008, reason="Missing token")
+        return
+    # Fetch VM details; only the DB row is needed, not its Kubernetes status.
+    # Auth failures close the socket with a policy violation rather than
+    # surfacing as a server error.
+    try:
+        user = await get_user_from_token(ws_token_to_jwt(raw_token))
+        vm = await fetch_vm_row(id)
+        authorize_vm(vm, user)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
         return
 
     # Kubernetes WebSocket URL
-    k8s_ws_url = f"{KUBERNATES_WS_URL}/apis/subresources.kubevirt.io/v1/namespaces/{vm.namespace}/virtualmachineinstances/{vm.name}/vnc"
+    k8s_ws_url = VNC_URL.format(namespace=vm["namespace"], name=vm["name"])
+
+    # KUBERNATES_WS_URL is a kubectl proxy that authenticates upstream on its
+    # own; the caller's JWT is only for this API and must not be forwarded
+    try:
+        async with get_ws_session().ws_connect(k8s_ws_url, **WS_CONNECT_OPTIONS) as k8s_websocket:
+            logger.debug("Connection open")
+
+            # Proxy messages between client and Kubernetes
+            await asyncio.gather(
+                _proxy_messages_from_fastapi(websocket, k8s_websocket),
+                _proxy_messages_from_k8s(k8s_websocket, websocket)
+            )
+    except Exception as e:
+        logger.warning("WebSocket proxy error: %s", e)
+    finally:
+        # The proxy loops may have closed it already
+        if websocket.application_state != WebSocketState.DISCONNECTED:
+            await websocket.close()
+        logger.debug("Connection closed")
+
+
+# ------------------ VNC Frame Pumps ------------------
+# Each direction is a producer reading frames into a bounded queue and a
+# consumer writing them out. A slow side blocks its producer once
+# VNC_READ_AHEAD frames are queued, and that backpressure reaches the
+# sender over TCP. Frames are never dropped: RFB is a byte stream, and
+# losing a frame desyncs the session instead of skipping a picture.
+# Binary frames queued behind an in-flight send go out as one frame.
+VNC_READ_AHEAD = 64
+VNC_COALESCE_LIMIT = 1024 * 1024
+_END_OF_STREAM = object()
+
+
+async def _fastapi_producer(source: WebSocket, queue: asyncio.Queue):
+    # The ASGI receive only yields data frames or a disconnect; control
+    # frames are answered by the server, so there is nothing else to route.
+    # Binary VNC frames take the first branch with a single dict lookup.
+    receive, put = source.receive, queue.put
+    try:
+        while True:
+            message = await receive()
+            data = message.get("bytes")
+            if data is not None:
+                await put((True, data))
+                continue
+            data = message.get("text")
+            if data is None:
+                break  # websocket.disconnect
+            await put((False, data))
+    except WebSocketDisconnect:
+        logger.debug("FastAPI WebSocket disconnected")
+    except Exception as e:
+        logger.warning("Error reading from FastAPI WebSocket: %s", e)
+    await queue.put(_END_OF_STREAM)
+
+
+# aiohttp frame type -> is_binary; anything else (ERROR) ends the stream
+_K8S_DATA_FRAMES = MappingProxyType({aiohttp.WSMsgType.BINARY: True, aiohttp.WSMsgType.TEXT: False})
 
-    headers = {
-        "Authorization": f"Bearer {token}"  # Include token in headers if required
-    }
 
+async def _k8s_producer(source: aiohttp.ClientWebSocketResponse, queue: asyncio.Queue):
+    # aiohttp answers pings itself (autoping) and ends the iteration on
+    # close, so only data frames reach the loop; VNC traffic is binary.
+    frame_kind, put = _K8S_DATA_FRAMES.get, queue.put
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.ws_connect(k8s_ws_url, headers=headers) as k8s_websocket:
-                print("Connection open")
-
-                # Proxy messages between client and Kubernetes
-                await asyncio.gather(
-                    _proxy_messages_from_fastapi(websocket, k8s_websocket),
-                    _proxy_messages_from_k8s(k8s_websocket, websocket)
-                )
+        async for message in source:
+            is_binary = frame_kind(message.type)
+            if is_binary is None:
+                break  # ERROR
+            await put((is_binary, message.data))
     except Exception as e:
-        print(f"WebSocket proxy error: {e}")
+        logger.warning("Error reading from K8s WebSocket: %s", e)
+    await queue.put(_END_OF_STREAM)
+
+
+async def _frame_consumer(queue: asyncio.Queue, send_bytes, send_text):
+    frame = await queue.get()
+    while frame is not _END_OF_STREAM:
+        is_binary, data = frame
+        if not is_binary:
+            await send_text(data)
+            frame = await queue.get()
+            continue
+
+        frame = None
+        while not queue.empty() and len(data) < VNC_COALESCE_LIMIT:
+            frame = queue.get_nowait()
+            if frame is _END_OF_STREAM or not frame[0]:
+                break
+            if not isinstance(data, bytearray):
+                data = bytearray(data)
+            data += frame[1]
+            frame = None
+        await send_bytes(bytes(data) if isinstance(data, bytearray) else data)
+        if frame is None:
+            frame = await queue.get()
+
+
+async def _pump(producer, consumer):
+    producer = asyncio.ensure_future(producer)
+    try:
+        await consumer
     finally:
-        await websocket.close()
-        print("Connection closed")
+        producer.cancel()
 
 
 async def _proxy_messages_from_fastapi(source: WebSocket, destination: aiohttp.ClientWebSocketResponse):
     """
     Proxy messages from FastAPI WebSocket to Kubernetes WebSocket.
     """
+    queue = asyncio.Queue(maxsize=VNC_READ_AHEAD)
     try:
-        while True:
-            message = await source.receive()
-            if "text" in message:
-                await destination.send_str(message["text"])
-            elif "bytes" in message:
-                await destination.send_bytes(message["bytes"])
-            elif "ping" in message:
-                await destination.ping()
-            elif "pong" in message:
-                await destination.pong()
-            elif "close" in message:
-                await destination.close()
-                break  # Exit loop on close
-    except WebSocketDisconnect:
-        print("FastAPI WebSocket disconnected")
+        await _pump(
+            _fastapi_producer(source, queue),
+            _frame_consumer(queue, destination.send_bytes, destination.send_str),
+        )
+        await destination.close()
     except Exception as e:
-        print(f"Error proxying messages from FastAPI to K8s: {e}")
+        logger.warning("Error proxying messages from FastAPI to K8s: %s", e)
 
 
 async def _proxy_messages_from_k8s(source: aiohttp.ClientWebSocketResponse, destination: WebSocket):
     """
     Proxy messages from Kubernetes WebSocket to FastAPI WebSocket.
     """
+    queue = asyncio.Queue(maxsize=VNC_READ_AHEAD)
     try:
-        async for message in source:
-            if message.type == aiohttp.WSMsgType.TEXT:
-                await destination.send_text(message.data)
-            elif message.type == aiohttp.WSMsgType.BINARY:
-                await destination.send_bytes(message.data)
-            elif message.type == aiohttp.WSMsgType.PING:
-                await destination.send_bytes(b'\x89')
-            elif message.type == aiohttp.WSMsgType.PONG:
-                await destination.send_bytes(b'\x8A')
-            elif message.type == aiohttp.WSMsgType.CLOSE:
-                await destination.close()
-                break  # Exit loop on close
+        await _pump(
+            _k8s_producer(source, queue),
+            _frame_consumer(queue, destination.send_bytes, destination.send_text),
+        )
+        await destination.close()
     except Exception as e:
-        print(f"Error proxying messages from K8s to FastAPI: {e}")
+        logger.warning("Error proxying messages from K8s to FastAPI: %s", e)
 
 class VMI(BaseModel):
     macAddress: str
@@ -498,23 +653,23 @@ class VMI(BaseModel):
 
 
 @router.get("/{id}/vmi", response_model=VMI)
-async def get_vmi(id: int, token=Depends(verify_token)):
+async def get_vmi(id: int, user: CurrentUser):
     """
     Fetch the IP address of a VM from Kubernetes.
     """
-    user = await get_user_from_token(token)
-    vm = await get_vm(id, user)  # Reuse existing auth check
+    # Only the DB row is needed here, not get_vm's Kubernetes status call
+    vm = await fetch_vm_row(id)
+    authorize_vm(vm, user)
 
     # Kubernetes API URL to get the VirtualMachineInstance (VMI) status
-    url = f"{KUBERNETES_API_URL}/apis/kubevirt.io/v1/namespaces/{vm.namespace}/virtualmachineinstances/{vm.name}"
+    url = VMI_URL.format(namespace=vm["namespace"], name=vm["name"])
     
-    async with httpx.AsyncClient(verify=False) as client:
-        response = await client.get(url, headers=HEADERS)
+    response = await kube_get(url, params=CACHED_READ)
 
     if response.status_code != 200:
         raise HTTPException(status_code=response.status_code, detail=f"Failed to fetch VM IP: {response.text}")
     
-    vmi_status = response.json()
+    vmi_status = orjson.loads(response.content)
     interfaces = vmi_status.get("status", {}).get("interfaces", [])
 
     
@@ -531,11 +686,10 @@ async def get_vmi(id: int, token=Depends(verify_token)):
 
 ####
 @router.get("/{id}/metrics", response_model=VMMetrics)  # This comes AFTER
-async def get_single_vm_metrics(id: int, token=Depends(verify_token)):
+async def get_single_vm_metrics(id: int, user: CurrentUser):
     """
     Get metrics for a specific VM by ID
     """
-    user = await get_user_from_token(token)
     vm = await get_vm(id, user)
     
     # Verify ownership for non-admins
@@ -1,19 +1,18 @@
-import httpx
-import json
+import orjson
+from cachetools import TTLCache
 from fastapi import HTTPException
-from sqlalchemy import insert, select, delete
+from sqlalchemy import insert, select, delete, bindparam
 from app.db.database import database
 from app.db.models import vm_instances, users, vm_costs
 from app.vms.schemas import *
-from app.core.variables import KUBERNETES_API_URL, HEADERS
-from datetime import datetime
+from app.core.kube import kube_client, JSON_HEADERS
+from app.core.variables import KUBERNETES_API_URL, NAMESPACE
+from app.vms.informer import vm_informer, pvc_informer
 from typing import List, Optional
 import uuid
 import asyncio
 
 
-min_abs = lambda a, b: ((b ^ ((a ^ b) & -(a < b))) ^ ((b ^ ((a ^ b) & -(a < b))) >> 31)) - ((b ^ ((a ^ b) & -(a < b))) >> 31)
-
 # Fixed rates (cents per hour)
 CPU_COST_PER_CORE = 10  # $0.10/core/hour
 RAM_COST_PER_GB = 5     # $0.05/GB/hour
@@ -25,18 +24,80 @@ def calculate_cost(cpu: int, ram: int) -> int:
 # ------------------ HELPER: Check VM in Kubernetes ------------------
 # ------------------ HELPER: Check VM in Kubernetes ------------------
 # ------------------ HELPER: Check VM in Kubernetes ------------------
+# The UI polls VM lists from many clients; statuses are shared across
+# users for a few seconds and dropped when this process changes the VM.
+VM_STATUS_CACHE_TTL = 3  # seconds
+_vm_status_cache = TTLCache(maxsize=1024, ttl=VM_STATUS_CACHE_TTL)
+
+VM_STATUS_CONCURRENCY = asyncio.Semaphore(32)
+
+def invalidate_vm_status(namespace: str, name: str) -> None:
+    _vm_status_cache.pop((namespace, name), None)
+
 async def check_vm_in_kube(namespace: str, name: str) -> KubernetesVmStatus:
+    """Kubernetes status of a VM, from the watch cache or else a short-lived cache."""
+    if namespace == NAMESPACE and vm_informer.synced:
+        return await vm_status_from_object(namespace, vm_informer.get(name))
+
+    kube_status = _vm_status_cache.get((namespace, name))
+    if kube_status is None:
+        kube_status = await fetch_vm_status(namespace, name)
+        _vm_status_cache[(namespace, name)] = kube_status
+    return kube_status
+
+async def fetch_vm_status(namespace: str, name: str) -> KubernetesVmStatus:
     """Check if a VM exists in Kubernetes and return its status, including attached PVCs."""
     url = f"{KUBERNETES_API_URL}/apis/kubevirt.io/v1/namespaces/{namespace}/virtualmachines/{name}"
     
-    async with httpx.AsyncClient(verify=False) as client:
-        response = await client.get(url, headers=HEADERS)
+    response = await kube_client.get(url)
 
     if response.status_code != 200:
+        return build_vm_status(None, {})
+
+    return await vm_status_from_object(namespace, orjson.loads(response.content))
+
+async def vm_status_from_object(namespace: str, vm_data: Optional[dict]) -> KubernetesVmStatus:
+    """Status of a VirtualMachine object already in hand, with its PVCs from the watch cache or the API."""
+    if vm_data is None:
+        return build_vm_status(None, {})
+    pvc_names = vm_pvc_names(vm_data)
+    if namespace == NAMESPACE and pvc_informer.synced:
+        pvc_objects = {n: pvc_informer.get(n) for n in pvc_names if pvc_informer.get(n)}
+    else:
+        pvc_objects = await fetch_pvcs(namespace, pvc_names)
+    return build_vm_status(vm_data, pvc_objects)
+
+def vm_pvc_names(vm_data: dict) -> List[str]:
+    """Names of the PVCs a VM's volumes use."""
+    pvc_names = []
+    for v in vm_data.get("spec", {}).get("template", {}).get("spec", {}).get("volumes", []):
+        if "persistentVolumeClaim" in v:
+            pvc_names.append(v["persistentVolumeClaim"]["claimName"])
+        elif "dataVolume" in v:
+            # A DataVolume's PVC carries the DataVolume's name
+            pvc_names.append(v["dataVolume"]["name"])
+    return pvc_names
+
+async def fetch_pvcs(namespace: str, pvc_names: List[str]) -> dict:
+    """PVC objects by name, fetched at once; a failed or missing claim is left out."""
+    pvc_responses = await asyncio.gather(*(
+        kube_client.get(f"{KUBERNETES_API_URL}/api/v1/namespaces/{namespace}/persistentvolumeclaims/{pvc_name}")
+        for pvc_name in pvc_names
+    ), return_exceptions=True)
+
+    return {
+        pvc_name: orjson.loads(pvc_response.content)
+        for pvc_name, pvc_response in zip(pvc_names, pvc_responses)
+        if not isinstance(pvc_response, Exception) and pvc_response.status_code == 200
+    }
+
+def build_vm_status(vm_data: Optional[dict], pvc_objects: dict) -> KubernetesVmStatus:
+    """KubernetesVmStatus from a VirtualMachine object (None if it doesn't exist) and its PVC objects."""
+    if vm_data is None:
         return KubernetesVmStatus(
             uid=None,
             creationTimestamp=None,
-            cores="Unknown",
+            cores=None,
             memory="Unknown",
             status="Not Found",
             networks=[],
@@ -44,119 +105,104 @@ async def check_vm_in_kube(namespace: str, name: str) -> KubernetesVmStatus:
             volumes=[],
         )
 
-    vm_data = response.json()
     metadata = vm_data.get("metadata", {})
-    spec = vm_data.get("spec", {})
     status = vm_data.get("status", {})
+    # Resolve the nested VMI template once instead of per field
+    template_spec = vm_data.get("spec", {}).get("template", {}).get("spec", {})
+    domain = template_spec.get("domain", {})
+    devices = domain.get("devices", {})
+
+    # Kubernetes already validated these objects, so the models are
+    # constructed without running pydantic validation again
+    volumes = [
+        Volume.model_construct(name=v.get("name"), containerDiskImage=v.get("containerDisk", {}).get("image"))
+        for v in template_spec.get("volumes", ())
+    ]
+
+    pvcs = [
+        PersistentVolumeClaim.model_construct(
+            name=pvc_name,
+            size=pvc_data.get("spec", {}).get("resources", {}).get("requests", {}).get("storage"),
+            status=pvc_data.get("status", {}).get("phase")
+        )
+        for pvc_name, pvc_data in pvc_objects.items()
+    ]
 
-    # Extract volumes and find PVCs
-    volumes_data = spec.get("template", {}).get("spec", {}).get("volumes", [])
-    volumes = []
-    pvc_names = []
-    
-    for v in volumes_data:
-        if "persistentVolumeClaim" in v:
-            pvc_names.append(v["persistentVolumeClaim"]["claimName"])
-        volumes.append(Volume(
-            name=v.get("name"),
-            containerDiskImage=v.get("containerDisk", {}).get("image")
-        ))
-
-    # Fetch details for each PVC
-    pvcs = []
-    async with httpx.AsyncClient(verify=False) as client:
-        for pvc_name in pvc_names:
-            pvc_url = f"{KUBERNETES_API_URL}/api/v1/namespaces/{namespace}/persistentvolumeclaims/{pvc_name}"
-            pvc_response = await client.get(pvc_url, headers=HEADERS)
-            
-            if pvc_response.status_code == 200:
-                pvc_data = pvc_response.json()
-                pvcs.append(PersistentVolumeClaim(
-                    name=pvc_name,
-                    size=pvc_data.get("spec", {}).get("resources", {}).get("requests", {}).get("storage"),
-                    status=pvc_data.get("status", {}).get("phase")
-                ))
-                
-
-    return KubernetesVmStatus(
+    return KubernetesVmStatus.model_construct(
         uid=metadata.get("uid"),
         creationTimestamp=metadata.get("creationTimestamp"),
-        cores=spec.get("template", {}).get("spec", {}).get("domain", {}).get("cpu", {}).get("cores", {}),
-        memory=spec.get("template", {}).get("spec", {}).get("domain", {}).get("resources", {}).get("requests", {}).get("memory", "Unknown"),
+        cores=domain.get("cpu", {}).get("cores"),
+        memory=domain.get("resources", {}).get("requests", {}).get("memory", "Unknown"),
         status=status.get("printableStatus", "Unknown"),
-        networks=[Network(name=n.get("name")) for n in spec.get("template", {}).get("spec", {}).get("networks", [])],
-        disks=[Disk(name=d.get("name"), bus=d.get("disk", {}).get("bus")) for d in spec.get("template", {}).get("spec", {}).get("domain", {}).get("devices", {}).get("disks", [])],
+        networks=[Network.model_construct(name=n.get("name")) for n in template_spec.get("networks", ())],
+        disks=[Disk.model_construct(name=d.get("name"), bus=d.get("disk", {}).get("bus")) for d in devices.get("disks", ())],
         volumes=volumes,
         pvcs=pvcs  # ✅ Now included in the response
     )
 
 # ------------------ LIST ALL VMs ------------------
-async def list_vms(user: dict) -> List[VirtualMachineResponse]:
-    """List VM instances stored in the database and check their status in Kubernetes."""
-    query = select(vm_instances)
-    if not user["is_admin"]:
-        query = query.where(vm_instances.c.user_id == user["id"])
-
-    vms = await database.fetch_all(query)
-    result = []
-
-    for vm in vms:
-        vm_dict = dict(vm)
-        kube_status = await check_vm_in_kube(NAMESPACE, vm_dict["name"])
-        result.append(VirtualMachineResponse(**vm_dict, kube_status=kube_status))
+# Only the columns VirtualMachineResponse carries
+VM_ROW_COLUMNS = [vm_instances.c[field] for field in VmInstanceBase.model_fields]
+_ALL_VM_ROWS = select(*VM_ROW_COLUMNS)
+_VM_ROWS_BY_USER = _ALL_VM_ROWS.where(vm_instances.c.user_id == bindparam("user_id"))
 
-    return result
+async def list_vm_rows(user: dict):
+    """VM instance rows visible to the user (all of them for admins), without Kubernetes status."""
+    if user["is_admin"]:
+        return await database.fetch_all(_ALL_VM_ROWS)
+    return await database.fetch_all(_VM_ROWS_BY_USER.params(user_id=user["id"]))
 
 
-import asyncio
-import httpx
-
-async def wait_for_datavolume(namespace: str, dv_name: str, timeout: int = 300, interval: int = 5) -> bool:
-    """
-    Wait for a DataVolume to reach the 'Succeeded' phase in Kubernetes.
-    
-    Args:
-        namespace (str): The namespace where the DataVolume is created.
-        dv_name (str): The name of the DataVolume.
-        timeout (int): Maximum time (seconds) to wait.
-        interval (int): Time between checks (seconds).
-    
-    Returns:
-        bool: True if DataVolume reaches 'Succeeded', False if timeout occurs.
-    """
-    url = f"{KUBERNETES_API_URL}/apis/cdi.kubevirt.io/v1beta1/namespaces/{namespace}/datavolumes/{dv_name}"
-
-    start_time = asyncio.get_event_loop().time()
-    
-    while asyncio.get_event_loop().time() - start_time < timeout:
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.get(url, headers=HEADERS)
-
-        if response.status_code == 200:
-            dv_status = response.json().get("status", {})
-            phase = dv_status.get("phase")
-
-            if phase == "Succeeded":
-                return True  # Success!
+async def list_vms(user: dict) -> List[VirtualMachineResponse]:
+    """List VM instances stored in the database and check their status in Kubernetes."""
+    vms = await list_vm_rows(user)
 
-        await asyncio.sleep(interval)  # Wait before next check
+    async def _status(vm):
+        async with VM_STATUS_CONCURRENCY:
+            return await check_vm_in_kube(NAMESPACE, vm["name"])
 
-    return False  # Timed out
+    # Statuses are fetched concurrently, capped so an admin-wide listing
+    # doesn't open hundreds of API server connections at once
+    kube_statuses = await asyncio.gather(*(_status(vm) for vm in vms))
+    # Rows and statuses are already well-typed; skip validating them again
+    return [
+        VirtualMachineResponse.model_construct(**vm._mapping, kube_status=kube_status)
+        for vm, kube_status in zip(vms, kube_statuses)
+    ]
 
 
 # ------------------ MAIN FUNCTION: Create Virtual Machine ------------------
 import uuid
-import json
-import httpx
 from fastapi import HTTPException
 from sqlalchemy import insert, select
-from datetime import datetime
 from app.db.database import database
 from app.db.models import vm_instances, templates
-from app.core.variables import KUBERNETES_API_URL, HEADERS, NAMESPACE
+from app.core.variables import KUBERNETES_API_URL, NAMESPACE
+
+# Cloud-init user data; only the password varies per VM
+CLOUD_INIT_USER_DATA = (
+    "#cloud-config\n"
+    "password: %s\n"
+    "chpasswd: { expire: False }\n"
+    "ssh_pwauth: True\n"
+    "ssh_authorized_keys:\n"
+    "  - \"your-ssh-public-key-here\""
+)
+
+# Parts of the VM manifest that are the same for every VM. They are only
+# read by orjson.dumps, so each request references them instead of
+# rebuilding them
+VM_DEVICES = {
+    "disks": [
+        {"name": "rootdisk", "disk": {"bus": "virtio"}},
+        {"name": "cloudinitdisk", "disk": {"bus": "virtio"}},
+    ],
+    "interfaces": [{"name": "default", "bridge": {}}],
+}
+VM_NETWORKS = [{"name": "default", "multus": {"networkName": "br0"}}]  # Attach to bridge network
 
 async def create_vm(payload, user):
-    """Create a VM from a template after ensuring its DataVolume is ready."""
+    """Create a VM from a template; its root DataVolume is provisioned asynchronously along with it."""
     # Fetch the template
     query = select(templates).where(templates.c.id == payload.template_id)
     template = await database.fetch_one(query)
@@ -168,79 +214,44 @@ async def create_vm(payload, user):
     unique_dv_name = f"{payload.name}-dv-{uuid.uuid4().hex[:6]}"
 
     # todo replace max_space and max_cpu and max_ram with user input ram cpu etc.
-    # Step 2️⃣: Create DataVolume first
-    datavolume_body = {
-        "apiVersion": "cdi.kubevirt.io/v1beta1",
-        "kind": "DataVolume",
-        "metadata": {"name": unique_dv_name, "namespace": NAMESPACE},
+    # Step 2️⃣: Describe the DataVolume; the VM below embeds it as a
+    # dataVolumeTemplate, so KubeVirt creates it and starts the VM once
+    # the import is done, without a separate POST or a wait here
+    datavolume_template = {
+        "metadata": {"name": unique_dv_name},
         "spec": {
             "source": {"http": {"url": template.qemu_image}},
             "pvc": {
                 "accessModes": ["ReadWriteOnce"],
-                "resources": {"requests": {"storage": f"{min_abs(template.max_space, payload.space)}Gi"}},
+                "resources": {"requests": {"storage": f"{min(template.max_space, payload.space)}Gi"}},
                 "storageClassName": "standard"  # Update based on your storage setup
             }
         }
     }
 
-    async with httpx.AsyncClient(verify=False) as client:
-        response = await client.post(
-            f"{KUBERNETES_API_URL}/apis/cdi.kubevirt.io/v1beta1/namespaces/{NAMESPACE}/datavolumes",
-            json=datavolume_body,
-            headers=HEADERS
-        )
-
-    if response.status_code != 201:
-        raise HTTPException(status_code=response.status_code, detail=f"Failed to create DataVolume: {response.text}")
-
-    # Step 3️⃣: Wait for DataVolume to be ready
-    if not await wait_for_datavolume(NAMESPACE, unique_dv_name):
-        raise HTTPException(status_code=500, detail="DataVolume creation timed out")
-
-    # Step 4️⃣: Modify VM Template to Use PVC Reference
+    # Step 3️⃣: Modify VM Template to Use the DataVolume
     updated_vm_config = {
         "domain": {
             "cpu": {
-                "cores": min_abs(template.max_cpu, payload.cpu)
+                "cores": min(template.max_cpu, payload.cpu)
             },
             "resources": {
                 "requests": {
-                "memory": f"{min_abs(template.max_ram, payload.ram)}Gi"
+                "memory": f"{min(template.max_ram, payload.ram)}Gi"
                 }
             },
-            "devices": {
-                "disks": [
-                {
-                    "name": "rootdisk",
-                    "disk": {
-                    "bus": "virtio"
-                    }
-                },
-                {
-                    "name": "cloudinitdisk",
-                    "disk": {
-                    "bus": "virtio"
-                    }
-                }
-                ],
-                "interfaces": [
-                {
-                    "name": "default",
-                    "bridge": {}
-                }
-                ]
-            }
+            "devices": VM_DEVICES
         }, 
-        "networks": [{"name": "default", "multus": {"networkName": "br0"}}],  # Attach to bridge network
+        "networks": VM_NETWORKS,
         "volumes": [
-            {"name": "rootdisk", "persistentVolumeClaim": {"claimName": unique_dv_name}},  
-            {"name": "cloudinitdisk", "cloudInitNoCloud": {"userData": "#cloud-config\npassword: " + payload.password + "\nchpasswd: { expire: False }\nssh_pwauth: True\nssh_authorized_keys:\n  - \"your-ssh-public-key-here\""}}
+            {"name": "rootdisk", "dataVolume": {"name": unique_dv_name}},  
+            {"name": "cloudinitdisk", "cloudInitNoCloud": {"userData": CLOUD_INIT_USER_DATA % payload.password}}
             #todo change password to one chosen by the user and remove ssh keys
             #todo also change username
         ]
     }
 
-    # Step 5️⃣: Create VirtualMachine
+    # Step 4️⃣: Create VirtualMachine
     vm_body = {
         "apiVersion": "kubevirt.io/v1",
         "kind": "VirtualMachine",
@@ -251,6 +262,7 @@ async def create_vm(payload, user):
         },
         "spec": {
             "runStrategy": "Always",  # Ensures the VM runs persistently
+            "dataVolumeTemplates": [datavolume_template],
             "template": {
                 "metadata": {"labels": {"kubevirt.io/domain": payload.name}},
                 "spec": updated_vm_config
@@ -258,38 +270,39 @@ async def create_vm(payload, user):
         }
     }
 
-    async with httpx.AsyncClient(verify=False) as client:
-        response = await client.post(
-            f"{KUBERNETES_API_URL}/apis/kubevirt.io/v1/namespaces/{NAMESPACE}/virtualmachines",
-            json=vm_body,
-            headers=HEADERS
-        )
+    response = await kube_client.post(
+        f"{KUBERNETES_API_URL}/apis/kubevirt.io/v1/namespaces/{NAMESPACE}/virtualmachines",
+        content=orjson.dumps(vm_body),
+        headers=JSON_HEADERS,
+    )
 
     if response.status_code != 201:
         raise HTTPException(status_code=response.status_code, detail=f"Failed to create VM: {response.text}")
 
-    # Step 6️⃣: Store the VM in the database
-    query = insert(vm_instances).values(
-        name=payload.name,
-        namespace=NAMESPACE,
-        user_id=user["id"],
-        template_id=payload.template_id,
-        created_at=datetime.utcnow(),
-    )
-    vm_id = await database.execute(query)
-
-    # Add cost logging after VM creation
+    # Step 5️⃣: Store the VM and its cost record in a single transaction
+    vm_row = {
+        "name": payload.name,
+        "namespace": NAMESPACE,
+        "user_id": user["id"],
+        "template_id": payload.template_id,
+    }
     cost = calculate_cost(payload.cpu, payload.ram)
-    query = insert(vm_costs).values(
-        vm_instance_id=vm_id,
-        cpu_cores=payload.cpu,
-        ram_gb=payload.ram,
-        cost_per_hour=cost,
-        recorded_at=datetime.utcnow(),
-    )
-    await database.execute(query)
+    async with database.transaction():
+        created = await database.fetch_one(
+            insert(vm_instances).values(**vm_row).returning(vm_instances.c.id, vm_instances.c.created_at)
+        )
+        await database.execute(insert(vm_costs).values(
+            vm_instance_id=created["id"],
+            cpu_cores=payload.cpu,
+            ram_gb=payload.ram,
+            cost_per_hour=cost,
+        ))
 
-    return await get_vm(vm_id, user)
+    # The row was just written by this user, and the POST answered with the
+    # created VirtualMachine, so nothing needs re-reading. Its DataVolume
+    # has only just been requested, so no PVCs are listed yet.
+    kube_status = build_vm_status(orjson.loads(response.content), {})
+    return VirtualMachineResponse.model_construct(**vm_row, **created._mapping, kube_status=kube_status)
 
 
 # ------------------ GET A VM ------------------
@@ -306,7 +319,7 @@ async def get_vm(id: int, user: dict) -> VirtualMachineResponse:
         raise HTTPException(status_code=403, detail="Not authorized to view this VM")
 
     kube_status = await check_vm_in_kube(NAMESPACE, vm["name"])
-    return VirtualMachineResponse(**dict(vm), kube_status=kube_status)
+    return VirtualMachineResponse.model_construct(**vm._mapping, kube_status=kube_status)
 
 
 # ------------------ DELETE A VM ------------------
@@ -322,14 +335,12 @@ async def delete_vm(id: int, user: dict):
     if not user["is_admin"] and vm["user_id"] != user["id"]:
         raise HTTPException(status_code=403, detail="Not authorized to delete this VM")
 
-    # Delete from Kubernetes
+    # Delete from Kubernetes and the DB at once; the Kubernetes response
+    # doesn't gate the DB delete, so neither has to wait for the other
     url = f"{KUBERNETES_API_URL}/apis/kubevirt.io/v1/namespaces/{NAMESPACE}/virtualmachines/{vm['name']}"
-    async with httpx.AsyncClient(verify=False) as client:
-        await client.delete(url, headers=HEADERS)
-
-    # Remove from DB
     query = delete(vm_instances).where(vm_instances.c.id == id)
-    await database.execute(query)
+    await asyncio.gather(kube_client.delete(url), database.execute(query))
+    invalidate_vm_status(NAMESPACE, vm["name"])
 
     return {"message": "VM deleted successfully"}
 
@@ -348,8 +359,7 @@ async def power_vm(id: int, user: dict, action: str):
 
     # Send request to Kubernetes
     url = f"{KUBERNETES_API_URL}/apis/subresources.kubevirt.io/v1/namespaces/{NAMESPACE}/virtualmachines/{vm['name']}/{action}"
-    async with httpx.AsyncClient(verify=False) as client:
-        response = await client.put(url, headers=HEADERS)
+    response = await kube_client.put(url)
 
     if response.status_code != 202:
         raise HTTPException(status_code=response.status_code, detail=f"Failed to {action} VM: {response.text}")
@@ -1,26 +1,61 @@
 import uuid
 import asyncio
-from datetime import datetime
 
-import httpx
+import orjson
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import insert, select, delete
+from sqlalchemy import insert, select, delete, bindparam, and_
 from app.db.database import database
 from app.db.models import vm_instances, vm_snapshots, users
-from app.core.variables import KUBERNETES_API_URL, HEADERS
+from app.core.kube import kube_client, JSON_HEADERS
+from app.core.variables import KUBERNETES_API_URL, NAMESPACE
+from app.vms.informer import snapshot_informer
 from app.core.security import verify_token
 from app.vms.schemas import VMSnapshot  # Ensure this schema is updated as needed
 
 # ------------------ Helper: Fetch VM from DB (and verify ownership) ------------------
-async def fetch_vm_from_db(vm_id: int, user: dict):
-    query = select(vm_instances).where(vm_instances.c.id == vm_id)
-    vm = await database.fetch_one(query)
+_VM_BY_ID = select(vm_instances).where(vm_instances.c.id == bindparam("id"))
+
+async def fetch_vm_row(vm_id: int):
+    """VM row without the ownership check, so it can be fetched alongside the user."""
+    vm = await database.fetch_one(_VM_BY_ID.params(id=vm_id))
     if not vm:
         raise HTTPException(status_code=404, detail="VM not found")
+    return vm
+
+def authorize_vm(vm, user: dict):
     if not user["is_admin"] and vm["user_id"] != user["id"]:
         raise HTTPException(status_code=403, detail="Not authorized for this VM")
+
+async def fetch_vm_from_db(vm_id: int, user: dict):
+    vm = await fetch_vm_row(vm_id)
+    authorize_vm(vm, user)
     return dict(vm)
 
+# ------------------ Helper: Fetch a VM's snapshot (and verify ownership) ------------------
+# The VM and the snapshot come back in one round trip. The outer join
+# still yields the VM row when the snapshot is missing, so the two 404s
+# stay distinguishable.
+_VM_SNAPSHOT_BY_ID = select(
+    vm_instances.c.user_id,
+    vm_instances.c.namespace,
+    vm_snapshots.c.id,
+    vm_snapshots.c.snapshot_name,
+).select_from(
+    vm_instances.outerjoin(vm_snapshots, and_(
+        vm_snapshots.c.vm_instance_id == vm_instances.c.id,
+        vm_snapshots.c.id == bindparam("snap_id"),
+    ))
+).where(vm_instances.c.id == bindparam("vm_id"))
+
+async def fetch_snapshot_from_db(vm_id: int, snap_id: int, user: dict):
+    row = await database.fetch_one(_VM_SNAPSHOT_BY_ID.params(vm_id=vm_id, snap_id=snap_id))
+    if not row:
+        raise HTTPException(status_code=404, detail="VM not found")
+    authorize_vm(row, user)
+    if row["id"] is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return row
+
 # ------------------ SNAPSHOT FUNCTIONS ------------------
 
 async def create_snapshot(vm_id: int, user: dict) -> VMSnapshot:
@@ -57,12 +92,11 @@ async def create_snapshot(vm_id: int, user: dict) -> VMSnapshot:
         }
     }
 
-    async with httpx.AsyncClient(verify=False) as client:
-        kube_response = await client.post(
-            f"{KUBERNETES_API_URL}/apis/snapshot.kubevirt.io/v1alpha1/namespaces/{vm['namespace']}/virtualmachinesnapshots",
-            json=snapshot_manifest,
-            headers=HEADERS
-        )
+    kube_response = await kube_client.post(
+        f"{KUBERNETES_API_URL}/apis/snapshot.kubevirt.io/v1alpha1/namespaces/{vm['namespace']}/virtualmachinesnapshots",
+        content=orjson.dumps(snapshot_manifest),
+        headers=JSON_HEADERS,
+    )
 
     if kube_response.status_code != 201:
         raise HTTPException(
@@ -74,19 +108,23 @@ async def create_snapshot(vm_id: int, user: dict) -> VMSnapshot:
     insert_query = insert(vm_snapshots).values(
         vm_instance_id=vm["id"],
         snapshot_name=snapshot_name,
-        created_at=datetime.utcnow()
-    )
-    snapshot_id = await database.execute(insert_query)
+    ).returning(vm_snapshots.c.id, vm_snapshots.c.created_at)
+    snapshot = await database.fetch_one(insert_query)
 
     # Return snapshot details with the proper ID from the DB
     return VMSnapshot(
-        id=snapshot_id,  # The ID now comes from the database
+        id=snapshot["id"],  # The ID now comes from the database
         name=snapshot_name,
         namespace=vm["namespace"],
-        creationTimestamp=datetime.utcnow().isoformat(),
+        creationTimestamp=snapshot["created_at"].isoformat(),
     )
 
 
+# Only what the listing returns; created_at comes from Kubernetes
+_SNAPSHOTS_BY_VM = select(vm_snapshots.c.id, vm_snapshots.c.snapshot_name).where(
+    vm_snapshots.c.vm_instance_id == bindparam("vm_id")
+)
+
 async def get_snapshots(vm_id: int, user: dict) -> list[VMSnapshot]:
     """
     List all snapshots for a given VM.
@@ -96,28 +134,32 @@ async def get_snapshots(vm_id: int, user: dict) -> list[VMSnapshot]:
     vm = await fetch_vm_from_db(vm_id, user)
 
     # Get snapshot records from DB
-    query = select(vm_snapshots).where(vm_snapshots.c.vm_instance_id == vm["id"])
-    snapshot_records = await database.fetch_all(query)
+    snapshot_records = await database.fetch_all(_SNAPSHOTS_BY_VM.params(vm_id=vm["id"]))
+
+    if vm["namespace"] == NAMESPACE and snapshot_informer.synced:
+        # Served from the watch cache, no API calls
+        snap_objects = [snapshot_informer.get(record["snapshot_name"]) for record in snapshot_records]
+    else:
+        # Query every snapshot's status at once
+        kube_responses = await asyncio.gather(*(
+            kube_client.get(f"{KUBERNETES_API_URL}/apis/snapshot.kubevirt.io/v1alpha1/namespaces/{vm['namespace']}/virtualmachinesnapshots/{record['snapshot_name']}")
+            for record in snapshot_records
+        ))
+        snap_objects = [
+            orjson.loads(kube_response.content) if kube_response.status_code == 200 else None
+            for kube_response in kube_responses
+        ]
 
     snapshots = []
-    async with httpx.AsyncClient(verify=False) as client:
-        for record in snapshot_records:
-            snapshot_name = record["snapshot_name"]
-            url = f"{KUBERNETES_API_URL}/apis/snapshot.kubevirt.io/v1alpha1/namespaces/{vm['namespace']}/virtualmachinesnapshots/{snapshot_name}"
-            kube_response = await client.get(url, headers=HEADERS)
-            if kube_response.status_code == 200:
-                snap_data = kube_response.json()
-                creation_ts = snap_data.get("metadata", {}).get("creationTimestamp")
-            else:
-                creation_ts = None
-            
-
-            snapshots.append(VMSnapshot(
-                id=record["id"],
-                name=snapshot_name,
-                namespace=vm["namespace"],
-                creationTimestamp=creation_ts,
-            ))
+    for record, snap_data in zip(snapshot_records, snap_objects):
+        creation_ts = snap_data.get("metadata", {}).get("creationTimestamp") if snap_data else None
+
+        snapshots.append(VMSnapshot.model_construct(
+            id=record["id"],
+            name=record["snapshot_name"],
+            namespace=vm["namespace"],
+            creationTimestamp=creation_ts,
+        ))
     return snapshots
 
 
@@ -130,30 +172,30 @@ async def get_snapshot_details(vm_id: int, snap_id: int, user: dict) -> VMSnapsh
     2. Use the stored snapshot_name to query Kubernetes.
     3. Return the snapshot details.
     """
-    vm = await fetch_vm_from_db(vm_id, user)
-
-    # Verify snapshot exists in DB using its primary key (snap_id)
-    query = select(vm_snapshots).where(vm_snapshots.c.id == snap_id)
-    record = await database.fetch_one(query)
-    if not record:
-        raise HTTPException(status_code=404, detail="Snapshot not found")
+    # Verify ownership and that the snapshot belongs to this VM
+    record = await fetch_snapshot_from_db(vm_id, snap_id, user)
 
     snapshot_name = record["snapshot_name"]
-    url = f"{KUBERNETES_API_URL}/apis/snapshot.kubevirt.io/v1alpha1/namespaces/{vm['namespace']}/virtualmachinesnapshots/{snapshot_name}"
-    async with httpx.AsyncClient(verify=False) as client:
-        kube_response = await client.get(url, headers=HEADERS)
+    if record["namespace"] == NAMESPACE and snapshot_informer.synced:
+        snap_data = snapshot_informer.get(snapshot_name)
+        if snap_data is None:
+            raise HTTPException(status_code=404, detail="Failed to fetch snapshot from Kubernetes: not found")
+    else:
+        url = f"{KUBERNETES_API_URL}/apis/snapshot.kubevirt.io/v1alpha1/namespaces/{record['namespace']}/virtualmachinesnapshots/{snapshot_name}"
+        kube_response = await kube_client.get(url)
+
+        if kube_response.status_code != 200:
+            raise HTTPException(
+                status_code=kube_response.status_code,
+                detail=f"Failed to fetch snapshot from Kubernetes: {kube_response.text}"
+            )
+
+        snap_data = orjson.loads(kube_response.content)
 
-    if kube_response.status_code != 200:
-        raise HTTPException(
-            status_code=kube_response.status_code,
-            detail=f"Failed to fetch snapshot from Kubernetes: {kube_response.text}"
-        )
-
-    snap_data = kube_response.json()
     return VMSnapshot(
         id=record["id"],
         name=snap_data["metadata"]["name"],
-        namespace=vm["namespace"],
+        namespace=record["namespace"],
         creationTimestamp=snap_data["metadata"].get("creationTimestamp"),
     )
 
@@ -167,18 +209,12 @@ async def delete_snapshot(vm_id: int, snap_id: int, user: dict):
     2. Delete the snapshot from Kubernetes.
     3. Delete the record from the DB.
     """
-    vm = await fetch_vm_from_db(vm_id, user)
-
-    # Verify snapshot exists in DB using its primary key (snap_id)
-    query = select(vm_snapshots).where(vm_snapshots.c.id == snap_id)
-    record = await database.fetch_one(query)
-    if not record:
-        raise HTTPException(status_code=404, detail="Snapshot not found")
+    # Verify ownership and that the snapshot belongs to this VM
+    record = await fetch_snapshot_from_db(vm_id, snap_id, user)
 
     snapshot_name = record["snapshot_name"]
-    url = f"{KUBERNETES_API_URL}/apis/snapshot.kubevirt.io/v1alpha1/namespaces/{vm['namespace']}/virtualmachinesnapshots/{snapshot_name}"
-    async with httpx.AsyncClient(verify=False) as client:
-        kube_response = await client.delete(url, headers=HEADERS)
+    url = f"{KUBERNETES_API_URL}/apis/snapshot.kubevirt.io/v1alpha1/namespaces/{record['namespace']}/virtualmachinesnapshots/{snapshot_name}"
+    kube_response = await kube_client.delete(url)
 
     if kube_response.status_code not in (200, 202, 204):
         raise HTTPException(
@@ -0,0 +1,22 @@
+import os
+
+# app.core.variables reads these at import; the tests only need them set
+for name, value in {
+    "FRONTEND_URL": "http://localhost:3000",
+    "BACKEND_URL": "http://localhost:8000",
+    "DATABASE_URL": "sqlite:///:memory:",
+    "KUBERNETES_API_URL": "http://localhost:8001",
+    "KUBERNATES_WS_URL": "ws://localhost:8001",
+    "KUBERNETES_TOKEN": "test-token",
+    "DEFAULT_NODE": "minikube",
+    "NAMESPACE": "default",
+    "INTERFACE": "default",
+    "BRIDGE": "br0",
+    "DEFAULT_ADMIN": "admin",
+    "DEFAULT_ADMIN_PWD": "admin",
+    "CLAUDE_KEY": "test-key",
+    "SECRET_KEY": "test-secret",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+}.items():
+    os.environ.setdefault(name, value)
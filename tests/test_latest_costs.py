@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine, insert
+
+from app.db.models import metadata, vm_costs
+from app.vms.routes import _LATEST_COSTS
+
+
+def test_latest_cost_breaks_same_second_ties_by_id():
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    # A VM created and resized within one second: SQLite's CURRENT_TIMESTAMP
+    # gives both records the same recorded_at
+    same_second = datetime(2025, 1, 1, 12, 0, 0)
+    with engine.begin() as conn:
+        conn.execute(insert(vm_costs), [
+            {"vm_instance_id": 1, "cpu_cores": 1, "ram_gb": 1, "cost_per_hour": 10, "recorded_at": same_second},
+            {"vm_instance_id": 1, "cpu_cores": 4, "ram_gb": 2, "cost_per_hour": 50, "recorded_at": same_second},
+        ])
+        rows = conn.execute(_LATEST_COSTS, {"vm_ids": [1]}).all()
+
+    assert [(row.vm_instance_id, row.cost_per_hour) for row in rows] == [(1, 50)]